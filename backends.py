@@ -0,0 +1,163 @@
+import argparse
+import re
+import numpy as np
+from .config import (RETRIEVER_MODEL, RERANKER_MODEL, TOXICITY_MODEL, RETRIEVER_REVISION, RERANKER_REVISION,
+                     MODEL_BACKEND, ONNX_QUANTIZE, ONNX_CACHE_DIR, ONNX_QUANT_CONFIG, PARITY_TOLERANCE)
+
+# Inference backends for the three models. "torch" is the stock PyTorch model;
+# "onnx" exports the model once into ONNX_CACHE_DIR and runs it with ONNX
+# Runtime, optionally with dynamically quantized int8 weights (ONNX_QUANTIZE).
+# Requires `pip install optimum[onnxruntime]` (and sentence-transformers >= 4.1
+# for the cross-encoder) when any model uses "onnx".
+ROLES = ("retriever", "reranker", "toxicity")
+
+def backend_of(role):
+    backend = MODEL_BACKEND.get(role, "torch")
+    if backend not in ("torch", "onnx"):
+        raise ValueError(f"Unknown backend {backend!r} for {role}; expected 'torch' or 'onnx'")
+    return backend
+
+def model_tag(role, backend=None, quantize=None):
+    # suffix that keeps caches of different backends apart; "" for torch
+    backend = backend or backend_of(role)
+    if backend == "torch":
+        return ""
+    quantize = ONNX_QUANTIZE.get(role, False) if quantize is None else quantize
+    return f"+onnx-qint8-{ONNX_QUANT_CONFIG}" if quantize else "+onnx"
+
+def _export_dir(model_name, revision=None):
+    # one directory per model and pinned revision
+    name = model_name if revision is None else f"{model_name}@{revision}"
+    d = ONNX_CACHE_DIR / re.sub(r"[^A-Za-z0-9_.-]+", "--", name)
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+def _load_st_onnx(cls, model_name, revision, quantize):
+    # Shared by SentenceTransformer and CrossEncoder: export on first use, then
+    # load the (optionally quantized) ONNX file from the local directory.
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    local = _export_dir(model_name, revision)
+    fp32 = local / "onnx" / "model.onnx"
+    if not fp32.exists():
+        print(f"Exporting {model_name} to ONNX ({local})...")
+        model = cls(model_name, revision=revision, backend="onnx")
+        model.save_pretrained(str(local))
+    if not quantize:
+        return cls(str(local), backend="onnx", model_kwargs={"file_name": "onnx/model.onnx"})
+    qfile = f"onnx/model_qint8_{ONNX_QUANT_CONFIG}.onnx"
+    if not (local / qfile).exists():
+        print(f"Quantizing {model_name} ({ONNX_QUANT_CONFIG})...")
+        model = cls(str(local), backend="onnx", model_kwargs={"file_name": "onnx/model.onnx"})
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANT_CONFIG, str(local))
+    return cls(str(local), backend="onnx", model_kwargs={"file_name": qfile})
+
+def load_sentence_transformer(backend=None, quantize=None):
+    from sentence_transformers import SentenceTransformer
+    backend = backend or backend_of("retriever")
+    if backend == "torch":
+        return SentenceTransformer(RETRIEVER_MODEL, revision=RETRIEVER_REVISION)
+    quantize = ONNX_QUANTIZE.get("retriever", False) if quantize is None else quantize
+    return _load_st_onnx(SentenceTransformer, RETRIEVER_MODEL, RETRIEVER_REVISION, quantize)
+
+def load_cross_encoder(backend=None, quantize=None):
+    from sentence_transformers.cross_encoder import CrossEncoder
+    backend = backend or backend_of("reranker")
+    if backend == "torch":
+        return CrossEncoder(RERANKER_MODEL, revision=RERANKER_REVISION)
+    quantize = ONNX_QUANTIZE.get("reranker", False) if quantize is None else quantize
+    return _load_st_onnx(CrossEncoder, RERANKER_MODEL, RERANKER_REVISION, quantize)
+
+def load_toxicity_pipeline(backend=None, quantize=None):
+    from transformers import pipeline, AutoTokenizer
+    backend = backend or backend_of("toxicity")
+    if backend == "torch":
+        # some HF versions: top_k=None returns list/dicts correctly
+        return pipeline("text-classification", model=TOXICITY_MODEL, top_k=None)
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    quantize = ONNX_QUANTIZE.get("toxicity", False) if quantize is None else quantize
+    local = _export_dir(TOXICITY_MODEL)
+    if not (local / "model.onnx").exists():
+        print(f"Exporting {TOXICITY_MODEL} to ONNX ({local})...")
+        ORTModelForSequenceClassification.from_pretrained(TOXICITY_MODEL, export=True).save_pretrained(str(local))
+        AutoTokenizer.from_pretrained(TOXICITY_MODEL).save_pretrained(str(local))
+    file_name = "model.onnx"
+    if quantize:
+        # one file per quantization config, named like the sentence-transformers exports
+        suffix = f"qint8_{ONNX_QUANT_CONFIG}"
+        file_name = f"model_{suffix}.onnx"
+        if not (local / file_name).exists():
+            print(f"Quantizing {TOXICITY_MODEL} ({ONNX_QUANT_CONFIG})...")
+            qconfig = getattr(AutoQuantizationConfig, ONNX_QUANT_CONFIG)(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(str(local), file_name="model.onnx").quantize(
+                save_dir=str(local), quantization_config=qconfig, file_suffix=suffix)
+    model = ORTModelForSequenceClassification.from_pretrained(str(local), file_name=file_name)
+    return pipeline("text-classification", model=model, tokenizer=AutoTokenizer.from_pretrained(str(local)), top_k=None)
+
+def _label_scores(outputs):
+    labels = sorted({d["label"].lower() for out in outputs for d in out})
+    arr = np.zeros((len(outputs), len(labels)), dtype=np.float32)
+    for i, out in enumerate(outputs):
+        for d in out:
+            arr[i, labels.index(d["label"].lower())] = d["score"]
+    return arr
+
+def parity_report(roles=ROLES, quantize=None, n_texts=200):
+    # Score drift of the ONNX backend (quantized per ONNX_QUANTIZE unless
+    # overridden) against PyTorch on a sample of corpus and synthetic texts.
+    from .engine import get_default_engine
+    from .toxicity import run_toxicity
+    engine = get_default_engine()
+    doc_store = engine.doc_store
+    rng = np.random.default_rng(0)
+    chunk_idx = rng.choice(len(doc_store), size=min(n_texts, len(doc_store)), replace=False)
+    chunk_texts = doc_store.texts(chunk_idx)
+    syn_texts = engine.syn_texts()
+    if syn_texts:
+        queries = [syn_texts[i] for i in rng.choice(len(syn_texts), size=min(n_texts, len(syn_texts)), replace=False)]
+    else:
+        queries = [t[:200] for t in chunk_texts]
+
+    report = {}
+    for role in roles:
+        q = ONNX_QUANTIZE.get(role, False) if quantize is None else quantize
+        if role == "retriever":
+            ref = load_sentence_transformer("torch").encode(queries, convert_to_numpy=True, normalize_embeddings=True)
+            new = load_sentence_transformer("onnx", q).encode(queries, convert_to_numpy=True, normalize_embeddings=True)
+            cos = np.sum(ref * new, axis=1)
+            drift = float(1.0 - cos.min())
+            report[role] = {"min_cosine": float(cos.min()), "mean_cosine": float(cos.mean()), "drift": drift}
+        elif role == "reranker":
+            pairs = [[qq, t] for qq, t in zip(queries, chunk_texts)]
+            ref = np.asarray(load_cross_encoder("torch").predict(pairs, show_progress_bar=False)).reshape(-1)
+            new = np.asarray(load_cross_encoder("onnx", q).predict(pairs, show_progress_bar=False)).reshape(-1)
+            probs_ref, probs_new = 1 / (1 + np.exp(-ref)), 1 / (1 + np.exp(-new))
+            drift = float(np.abs(probs_ref - probs_new).max())
+            report[role] = {"max_abs_logit_diff": float(np.abs(ref - new).max()),
+                            "max_abs_prob_diff": drift, "mean_abs_prob_diff": float(np.abs(probs_ref - probs_new).mean())}
+        elif role == "toxicity":
+            texts = queries + [t[:1000] for t in chunk_texts]
+            ref = _label_scores(run_toxicity(load_toxicity_pipeline("torch"), texts))
+            new = _label_scores(run_toxicity(load_toxicity_pipeline("onnx", q), texts))
+            drift = float(np.abs(ref - new).max())
+            report[role] = {"max_abs_score_diff": drift, "mean_abs_score_diff": float(np.abs(ref - new).mean())}
+        else:
+            raise ValueError(f"Unknown model role {role!r}")
+        report[role].update({"quantized": bool(q), "drift": drift, "within_tolerance": drift <= PARITY_TOLERANCE})
+    return report
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export models to ONNX and report score drift against PyTorch.")
+    ap.add_argument("--models", nargs="+", default=list(ROLES), choices=ROLES)
+    ap.add_argument("--quantize", choices=("config", "yes", "no"), default="config",
+                    help="compare the int8 model ('yes'), the fp32 ONNX model ('no') or whatever ONNX_QUANTIZE says")
+    ap.add_argument("--n", type=int, default=200, help="number of sample texts")
+    args = ap.parse_args(argv)
+    quantize = {"config": None, "yes": True, "no": False}[args.quantize]
+    for role, r in parity_report(args.models, quantize, args.n).items():
+        verdict = "OK" if r["within_tolerance"] else f"exceeds PARITY_TOLERANCE={PARITY_TOLERANCE}"
+        details = ", ".join(f"{k}={v:.5f}" for k, v in r.items() if isinstance(v, float))
+        print(f"{role:<10} quantized={r['quantized']!s:<5} {details}  -> {verdict}")
+
+if __name__ == "__main__":
+    main()
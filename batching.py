@@ -0,0 +1,89 @@
+import queue
+import threading
+import time
+
+class _Request:
+    __slots__ = ("items", "done", "result", "error")
+
+    def __init__(self, items):
+        self.items = items
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+# Dynamic micro-batching in front of a model call. Concurrent submit() calls
+# are collected for up to max_wait_ms (or until max_items are queued), run as
+# one call to fn(items) and the results are handed back to each caller in
+# order. fn must return one result per item (list or array).
+class MicroBatcher:
+    def __init__(self, fn, max_items=64, max_wait_ms=5.0, name="batcher"):
+        self.fn = fn
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.requests = 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, items):
+        items = list(items)
+        if not items:
+            return []
+        self._ensure_started()
+        req = _Request(items)
+        self._queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        n = len(batch[0].items)
+        deadline = time.monotonic() + self.max_wait
+        while n < self.max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(req)
+            n += len(req.items)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [it for req in batch for it in req.items]
+            try:
+                results = self.fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: got {len(results)} results for {len(items)} items")
+                pos = 0
+                for req in batch:
+                    req.result = results[pos:pos + len(req.items)]
+                    pos += len(req.items)
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+            self.batches += 1
+            self.items += len(items)
+            self.requests += len(batch)
+            for req in batch:
+                req.done.set()
+
+    def stats(self):
+        return {"batches": self.batches, "requests": self.requests, "items": self.items,
+                "avg_batch_items": round(self.items / self.batches, 2) if self.batches else 0.0}
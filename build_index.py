@@ -0,0 +1,82 @@
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+from .config import INDEX_BUNDLE_PATH, RETRIEVER_REVISION, INDEX_TYPE, EMBED_STORAGE
+from .data_manager import load_corpus
+from .search_engine import load_embedder, load_syn_embeddings, load_chunk_embeddings, retriever_cache_name
+from .corpus_bundle import write_bundle, write_index_file, remove_stale_index_files, source_fingerprint, source_stats
+from .vector_index import build_faiss_index, index_params
+from .lexical import build_bm25_for_store
+
+def _text_buffer(texts):
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def build(out_path=INDEX_BUNDLE_PATH):
+    start = time.time()
+    syn, doc_store = load_corpus()
+    embedder = load_embedder()
+    syn_emb = load_syn_embeddings(embedder, syn)
+    chunk_emb = load_chunk_embeddings(embedder, doc_store)
+    syn_texts = syn["simple_question"].astype(str).tolist() if not syn.empty else []
+    syn_text_buf, syn_text_offsets = _text_buffer(syn_texts)
+
+    arrays = {
+        "syn_emb": syn_emb.data,
+        "chunk_emb": chunk_emb.data,
+        "policy_ids": doc_store.policy_ids,
+        "risk_codes": doc_store.risk_codes,
+        "risk_categories": doc_store.risk_categories,
+        "base_codes": doc_store.base_codes,
+        "base_ids": doc_store.base_ids,
+        "text_buf": doc_store.text_buf,
+        "text_offsets": doc_store.text_offsets,
+        "syn_policy_idx": doc_store.syn_policy_idx,
+        "syn_text_buf": syn_text_buf,
+        "syn_text_offsets": syn_text_offsets,
+    }
+    # int8 rows carry a per-row scale
+    if syn_emb.scales is not None:
+        arrays["syn_emb_scales"] = syn_emb.scales
+    if chunk_emb.scales is not None:
+        arrays["chunk_emb_scales"] = chunk_emb.scales
+    arrays.update(build_bm25_for_store(doc_store, syn_texts).arrays())
+    index_file = None
+    try:
+        if len(syn_emb) > 0:
+            index_file = write_index_file(build_faiss_index(syn_emb, INDEX_TYPE), out_path)
+    except ImportError:
+        print("FAISS not available — bundle will not contain a serialized index.")
+
+    meta = {
+        "retriever_model": retriever_cache_name(),
+        "retriever_revision": RETRIEVER_REVISION,
+        "dim": int(syn_emb.shape[1]) if len(syn_emb.shape) == 2 else 0,
+        "embed_storage": EMBED_STORAGE,
+        "num_syn": len(syn_texts),
+        "num_chunks": len(doc_store),
+        "sources": source_fingerprint(),
+        "source_stats": source_stats(),
+        "index_type": INDEX_TYPE,
+        "index_params": index_params(INDEX_TYPE),
+        "faiss_index_file": index_file,
+    }
+    header = write_bundle(out_path, arrays, meta)
+    remove_stale_index_files(out_path, index_file)
+    size_mb = Path(out_path).stat().st_size / 1e6
+    if index_file:
+        size_mb += (Path(out_path).parent / index_file).stat().st_size / 1e6
+    print(f"Wrote {out_path} (version {header['bundle_version']}, {size_mb:.1f} MB) in {time.time() - start:.1f}s.")
+    return header
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build the memory-mappable corpus bundle used at runtime.")
+    ap.add_argument("--out", default=str(INDEX_BUNDLE_PATH), help="output bundle path")
+    args = ap.parse_args(argv)
+    build(Path(args.out))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+def text_key(text):
+    return hashlib.blake2b(str(text).encode("utf-8"), digest_size=16).digest()
+
+# Bounded, thread-safe LRU with hit/miss/eviction counters.
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+# Disk-backed key/value cache in SQLite, safe to share between threads and
+# worker processes (WAL mode, one connection per thread and process). Values
+# are bytes; entries beyond max_entries / max_bytes are evicted least
+# recently used first.
+class SqliteCache:
+    def __init__(self, path, max_entries=None, max_bytes=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, size INTEGER, atime REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        conn = self._conn()
+        for lo in range(0, len(keys), 500):
+            part = keys[lo:lo + 500]
+            rows = conn.execute(f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(part))})", part).fetchall()
+            found.update(rows)
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE cache SET atime = ? WHERE key = ?", [(now, k) for k in found])
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        now = time.time()
+        rows = [(k, sqlite3.Binary(v), len(v), now) for k, v in items]
+        if not rows:
+            return
+        conn = self._conn()
+        conn.executemany("INSERT OR REPLACE INTO cache (key, value, size, atime) VALUES (?, ?, ?, ?)", rows)
+        with self._lock:
+            self._puts += len(rows)
+            due = self._puts >= 64
+            if due:
+                self._puts = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        conn = self._conn()
+        removed = 0
+        if self.max_entries is not None:
+            (n,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if n > self.max_entries:
+                removed += conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY atime LIMIT ?)",
+                                        (n - self.max_entries,)).rowcount
+        if self.max_bytes is not None:
+            (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()
+            while total > self.max_bytes:
+                rows = conn.execute("SELECT key, size FROM cache ORDER BY atime LIMIT 64").fetchall()
+                if not rows:
+                    break
+                conn.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k, _ in rows])
+                total -= sum(size for _, size in rows)
+                removed += len(rows)
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def entries(self, values=False):
+        # [(key, size, atime[, value])], most recently used first; does not
+        # count as a use
+        cols = "key, size, atime, value" if values else "key, size, atime"
+        return self._conn().execute(f"SELECT {cols} FROM cache ORDER BY atime DESC").fetchall()
+
+    def delete(self, keys):
+        conn = self._conn()
+        return conn.executemany("DELETE FROM cache WHERE key = ?", [(k,) for k in keys]).rowcount
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+
+    def stats(self):
+        n, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        lookups = self.hits + self.misses
+        return {"path": str(self.path), "entries": n, "bytes": total, "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,141 @@
+import argparse
+import json
+import time
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+from .config import (RETRIEVER_MODEL, RERANKER_MODEL, RERANK_TOP, QUERY_TOP_K, CASCADE_CALIBRATION_PATH,
+                     CASCADE_BOUND_QUANTILE, CASCADE_BINS, CASCADE_MIN_BIN_PAIRS, SPARSE_MODE)
+from .backends import model_tag
+from .risk_assessment import score_to_severity
+
+# RERANK_MODE="cascade" cross-encodes candidates in order of an upper bound on
+# their combined score and stops once no remaining candidate can beat the best
+# exact score, or skips the cross-encoder when no bound reaches a decision
+# threshold (search_engine.CASCADE_FLOOR). The bound on the cross-encoder probability given the bi-encoder
+# cosine comes from a calibration over synthetic queries: per cosine bin, the
+# CASCADE_BOUND_QUANTILE quantile of the probabilities seen, made
+# non-decreasing in cosine. A bin with fewer than CASCADE_MIN_BIN_PAIRS pairs
+# takes the bound of the next populated bin above it (1 above the last one);
+# without a calibration the bound is 1.
+
+def _models():
+    return {"retriever": RETRIEVER_MODEL + model_tag("retriever"), "reranker": RERANKER_MODEL + model_tag("reranker")}
+
+def fit_bound(cos_raw, probs, bins=CASCADE_BINS, quantile=CASCADE_BOUND_QUANTILE, min_pairs=CASCADE_MIN_BIN_PAIRS):
+    # -> per-bin upper bound over equal-width cosine bins on [-1, 1]
+    b = np.clip(((np.asarray(cos_raw) + 1.0) / 2.0 * bins).astype(np.int64), 0, bins - 1)
+    bound = np.ones(bins, dtype=np.float64)
+    fill = 1.0
+    for i in reversed(range(bins)):
+        p = np.asarray(probs)[b == i]
+        if len(p) >= min_pairs:
+            fill = np.quantile(p, quantile)
+        bound[i] = fill
+    return np.maximum.accumulate(bound)
+
+@lru_cache(maxsize=1)
+def _load_bound(path):
+    # None when missing or calibrated for other models
+    if path is None or not Path(path).exists():
+        return None
+    try:
+        calib = json.loads(Path(path).read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"[WARN] Ignoring cascade calibration {path}: {e}")
+        return None
+    if calib.get("models") != _models():
+        print(f"[WARN] Cascade calibration {path} is for other models; bounding by 1. Re-run calibrate.")
+        return None
+    return np.asarray(calib["bound"], dtype=np.float32)
+
+def prob_upper_bound(cos_raw, path=CASCADE_CALIBRATION_PATH):
+    cos_raw = np.asarray(cos_raw, dtype=np.float32)
+    bound = _load_bound(str(path) if path else None)
+    if bound is None:
+        return np.ones_like(cos_raw)
+    b = np.clip(((cos_raw + 1.0) / 2.0 * len(bound)).astype(np.int64), 0, len(bound) - 1)
+    return bound[b]
+
+def _sample_queries(engine, n, seed):
+    texts = engine.syn_texts()
+    if not texts:
+        raise SystemExit("No synthetic queries to sample.")
+    rows = np.random.default_rng(seed).choice(len(texts), size=min(n, len(texts)), replace=False)
+    return [texts[i] for i in rows]
+
+def calibrate(n_queries=1000, path=CASCADE_CALIBRATION_PATH, seed=0):
+    from .engine import get_default_engine
+    from .search_engine import retrieve_candidate_chunk_ids, rerank_chunks_with_probs
+    engine = get_default_engine()
+    cos_raw, probs = [], []
+    for q in _sample_queries(engine, n_queries, seed):
+        cand = retrieve_candidate_chunk_ids(q, top_k=QUERY_TOP_K, engine=engine)
+        for r in rerank_chunks_with_probs(q, cand, top_n=len(cand), engine=engine, mode="full"):
+            cos_raw.append(2.0 * r["cos_sim"] - 1.0)
+            probs.append(r["reranker_prob"])
+    bound = fit_bound(cos_raw, probs)
+    calib = {"models": _models(), "quantile": CASCADE_BOUND_QUANTILE, "min_bin_pairs": CASCADE_MIN_BIN_PAIRS,
+             "queries": n_queries, "pairs": len(probs), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+             "bound": [round(float(x), 6) for x in bound]}
+    Path(path).write_text(json.dumps(calib, indent=1), encoding="utf-8")
+    _load_bound.cache_clear()
+    print(f"Wrote {path} from {len(probs)} pairs over {n_queries} queries.")
+    return calib
+
+def agreement_report(n_queries=1000, seed=1):
+    # cascade vs. full on sampled synthetic queries: same top-1 policy (on the
+    # queries the cascade did not skip: a skipped one ranks by cosine), same
+    # severity of the top combined score, the share of pairs cross-encoded and
+    # of queries skipped
+    from .engine import get_default_engine
+    from .search_engine import retrieve_candidate_chunk_ids, rerank_chunks_with_probs
+    engine = get_default_engine()
+    top1 = severity = pairs = scored = skipped = 0
+    disagreements = []
+    queries = _sample_queries(engine, n_queries, seed)
+    for q in queries:
+        cand = retrieve_candidate_chunk_ids(q, top_k=QUERY_TOP_K, engine=engine)
+        full = rerank_chunks_with_probs(q, cand, top_n=RERANK_TOP, engine=engine, mode="full")
+        before = engine.counters.get("rerank_pairs_scored", 0)
+        fast = rerank_chunks_with_probs(q, cand, top_n=RERANK_TOP, engine=engine, mode="cascade")
+        scored += engine.counters.get("rerank_pairs_scored", 0) - before
+        pairs += len(cand)
+        f = (full[0]["policy_id"], full[0]["combined_score"]) if full else (None, 0.0)
+        c = (fast[0]["policy_id"], fast[0]["combined_score"]) if fast else (None, 0.0)
+        skip = bool(fast) and fast[0]["rerank_path"] == "skipped"
+        skipped += skip
+        same_top = skip or f[0] == c[0]
+        top1 += same_top
+        severity += score_to_severity(f[1]) == score_to_severity(c[1])
+        if not same_top or score_to_severity(f[1]) != score_to_severity(c[1]):
+            disagreements.append({"query": q, "full": f, "cascade": c})
+    n = max(len(queries), 1)
+    return {"queries": len(queries), "top1_agreement": (top1 - skipped) / max(len(queries) - skipped, 1),
+            "severity_agreement": severity / n, "skipped_share": skipped / n,
+            "pairs_scored_share": scored / max(pairs, 1), "disagreements": disagreements}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Calibrate the cascade reranker and check it against full reranking.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    cal = sub.add_parser("calibrate", help="fit the probability bound from synthetic queries")
+    cal.add_argument("--queries", type=int, default=1000)
+    cal.add_argument("--out", default=str(CASCADE_CALIBRATION_PATH))
+    chk = sub.add_parser("check", help="top-1 and severity agreement of cascade vs. full")
+    chk.add_argument("--queries", type=int, default=1000)
+    chk.add_argument("--show", type=int, default=10, help="disagreements to print")
+    args = ap.parse_args(argv)
+    if SPARSE_MODE == "sparse":
+        ap.error('SPARSE_MODE="sparse" reranks without cosines, so there is no cascade to calibrate or check')
+    if args.cmd == "calibrate":
+        calibrate(args.queries, args.out)
+        return
+    r = agreement_report(args.queries)
+    print(f"{r['queries']} queries: top-1 agreement {r['top1_agreement']:.4f} (not skipped), severity agreement "
+          f"{r['severity_agreement']:.4f}, {r['skipped_share']:.1%} skipped, "
+          f"{r['pairs_scored_share']:.1%} of pairs cross-encoded")
+    for d in r["disagreements"][:args.show]:
+        print(f"  {d['query'][:80]!r}: full {d['full'][0]} ({d['full'][1]:.3f}), cascade {d['cascade'][0]} ({d['cascade'][1]:.3f})")
+
+if __name__ == "__main__":
+    main()
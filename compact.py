@@ -0,0 +1,83 @@
+import numpy as np
+from .config import SCORE_BLOCK_ROWS
+
+STORAGES = ("float32", "float16", "int8")
+
+# Embedding matrix kept in its stored form: float32, float16, or int8 with a
+# float32 scale per row (row ~= data[i] * scales[i]). The data may be an
+# np.memmap; scoring upcasts SCORE_BLOCK_ROWS rows at a time so a full
+# float32 copy never exists.
+class CompactMatrix:
+    def __init__(self, data, scales=None):
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 0), dtype=np.float32))
+
+    @property
+    def storage(self):
+        return "int8" if self.scales is not None else np.dtype(self.data.dtype).name
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return int(self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        rows = np.asarray(self.data[idx], dtype=np.float32)
+        if self.scales is not None:
+            rows = rows * np.asarray(self.scales[idx], dtype=np.float32)[..., None]
+        return rows
+
+    def blocks(self, block_rows=SCORE_BLOCK_ROWS):
+        for lo in range(0, len(self), block_rows):
+            yield lo, self[lo:lo + block_rows]
+
+    def to_float32(self):
+        return self[:]
+
+    def dot(self, q, block_rows=SCORE_BLOCK_ROWS):
+        # q: (d,) or (nq, d) float32 -> scores (n,) or (nq, n)
+        q = np.asarray(q, dtype=np.float32)
+        single = q.ndim == 1
+        q = q.reshape(-1, q.shape[-1])
+        if self.storage == "float32":
+            out = q @ np.asarray(self.data).T
+        else:
+            out = np.empty((len(q), len(self)), dtype=np.float32)
+            for lo, block in self.blocks(block_rows):
+                out[:, lo:lo + len(block)] = q @ block.T
+        return out[0] if single else out
+
+def compress(emb, storage):
+    emb = np.asarray(emb, dtype=np.float32)
+    if storage == "float32":
+        return CompactMatrix(emb)
+    if storage == "float16":
+        return CompactMatrix(emb.astype(np.float16))
+    if storage == "int8":
+        scales = np.abs(emb).max(axis=1) / 127.0 if len(emb) else np.zeros(0, dtype=np.float32)
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        data = np.clip(np.rint(emb / scales[:, None]), -127, 127).astype(np.int8)
+        return CompactMatrix(data, scales)
+    raise ValueError(f"Unknown embedding storage {storage!r}; expected one of {STORAGES}")
+
+def describe(name, m):
+    # footprint of one matrix, compared with plain float32
+    if isinstance(m, CompactMatrix):
+        data, storage, nbytes = m.data, m.storage, m.nbytes
+    else:
+        data = np.asarray(m)
+        storage, nbytes = data.dtype.name, int(data.nbytes)
+    f32 = int(np.prod(data.shape)) * 4
+    return {"name": name, "storage": storage, "shape": list(data.shape), "bytes": nbytes,
+            "float32_bytes": f32, "ratio": round(nbytes / f32, 3) if f32 else 0.0,
+            "mmapped": isinstance(data, np.memmap)}
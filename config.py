@@ -9,22 +9,149 @@ GDPR_CHUNKS_CSV = "gdpr_chunks.csv"
 # Models & index settings
 RETRIEVER_MODEL = "all-mpnet-base-v2"
 RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+TOXICITY_MODEL = "unitary/toxic-bert"
+RETRIEVER_REVISION = None   # pin a HF commit/tag; part of the embedding cache key
+RERANKER_REVISION = None
+
+# Inference backend per model: "torch" or "onnx" (ONNX Runtime). ONNX exports
+# are cached in ONNX_CACHE_DIR; ONNX_QUANTIZE switches a model to dynamic int8
+# weights. Check drift first with `python -m risk_classifier.backends`.
+MODEL_BACKEND = {"retriever": "torch", "reranker": "torch", "toxicity": "torch"}
+ONNX_QUANTIZE = {"retriever": False, "reranker": False, "toxicity": False}
+ONNX_CACHE_DIR = Path("onnx_cache")
+ONNX_QUANT_CONFIG = "avx512_vnni"   # arm64, avx2, avx512 or avx512_vnni
+PARITY_TOLERANCE = 0.02             # max acceptable drift reported by the parity check
 EMBED_CACHE_DIR = Path("emb_cache")
 EMBED_CACHE_DIR.mkdir(exist_ok=True)
+# How syn/chunk embedding matrices are stored and memory-mapped:
+# "float32", "float16", or "int8" with a per-row scale. Scoring upcasts
+# SCORE_BLOCK_ROWS rows at a time; FAISS uses the matching scalar quantizer.
+EMBED_STORAGE = "float32"
+SCORE_BLOCK_ROWS = 8192
+INDEX_BUNDLE_PATH = Path("rc_index.bundle")   # built by `python -m risk_classifier.build_index`
+
+# Synthetic-query index: "flat" (exact), "ivf_flat", "hnsw" or "ivf_pq".
+# Non-flat indexes are trained once and persisted under INDEX_DIR;
+# compare recall with `python -m risk_classifier.vector_index`.
+INDEX_TYPE = "flat"
+# "auto" uses FAISS when it imports, else the exact NumPy backend (also for a
+# flat index over float16/int8 embeddings); "faiss" or "numpy" forces one.
+VECTOR_BACKEND = "auto"
+NUMPY_QUERY_ROWS = 256   # numpy backend: queries scored per block
+INDEX_DIR = Path("rc_indexes")
+IVF_NLIST = 256
+IVF_NPROBE = 16          # search-time: IVF lists visited per query
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64      # search-time: HNSW candidate list size
+PQ_M = 48                # sub-quantizers; must divide the embedding dim (768)
+PQ_NBITS = 8
 
 # Retrieval / rerank params
 TOP_K = 10           # used for PDF page retrieval (keeps small)
 QUERY_TOP_K = 50     # larger for interactive queries to increase recall
 RERANK_TOP = 6
+# "rows": search TOP_K/QUERY_TOP_K synthetic rows and dedupe by policy.
+# "grouped": max-pool row scores per policy and return the POLICY_TOP_N best
+# distinct policies directly (exact scoring; top_k is not used).
+RETRIEVAL_MODE = "rows"
+POLICY_TOP_N = 12
+# Sparse (BM25) retrieval over snippets + synthetic questions:
+# "off" - dense only; "hybrid" - BM25 candidates fused with the dense ones
+# (reciprocal rank fusion); "sparse" - BM25 only. In "sparse" mode no dense
+# model is loaded at all: candidates are reranked by the cross-encoder alone
+# (combined score = its probability; RERANK_MODE and RERANK_ALPHA are ignored).
+SPARSE_MODE = "off"
+SPARSE_TOP_N = 20
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+RERANK_ALPHA = 0.75   # combined_score = alpha * cross-encoder prob + (1 - alpha) * scaled cosine
+# "full": cross-encode every candidate. "cascade": cross-encode candidates in
+# order of an upper bound on their combined score (from a calibrated bound on
+# the cross-encoder probability given the cosine) and stop once none of the
+# rest can beat the best exact score; skip the cross-encoder when no bound
+# reaches SIM_THRESHOLD or a risk level. Only the top result is exact.
+# Calibrate and check agreement with `python -m risk_classifier.cascade calibrate|check`.
+RERANK_MODE = "full"
+CASCADE_CALIBRATION_PATH = Path("rc_cascade.json")
+CASCADE_BOUND_QUANTILE = 0.999   # of the probabilities seen per cosine bin
+CASCADE_BINS = 40
+CASCADE_MIN_BIN_PAIRS = 50       # sparser bins bound the probability by 1
+CASCADE_BATCH = 4                # pairs cross-encoded per round
+ENCODE_BATCH_SIZE = 32   # bi-encoder batch size for batched query encoding
+QUERY_EMB_CACHE_SIZE = 4096   # LRU entries shared by retrieval and reranking
+RERANK_CACHE_SIZE = 50000     # in-memory (query, policy) -> cross-encoder logit entries
+RERANK_CACHE_PATH = None      # e.g. Path("rc_cache/rerank.sqlite") to persist logits across runs and workers
+RERANK_CACHE_MAX_ENTRIES = 1000000
 SIM_THRESHOLD = 0.60
 
+# PII spans longer than this may be split when scanning a document in pieces
+PII_STREAM_OVERLAP = 256
+
+# classify_pdf document-level signals: "full" runs PII, toxicity, retrieval
+# and reranking over the joined text as well as every page; "pages" derives
+# them from the page results. DOC_RETRIEVAL_PASS adds, in "pages" mode, a
+# retrieval over the joined text; policies no page matched are cross-encoded
+# against it and join the violations.
+DOC_SIGNALS = "full"
+DOC_RETRIEVAL_PASS = True
+# iter_classify_pdf keeps at most this many contexts per policy and runs the
+# document retrieval pass over this many leading chars of text.
+STREAM_MAX_CONTEXTS = 5
+STREAM_DOC_CHARS = 20000
+
+# Micro-batching: merge concurrent encoder / reranker / toxicity calls into
+# one model call, waiting at most MICROBATCH_MAX_WAIT_MS for more requests.
+MICROBATCH_ENABLED = False
+MICROBATCH_MAX_ITEMS = 64
+MICROBATCH_MAX_WAIT_MS = 5.0
+TOXICITY_BATCH_SIZE = 32
+# Sentences longer than this many tokens are scored as overlapping windows
+# (max per label) instead of being truncated.
+TOXICITY_MAX_TOKENS = 510
+TOXICITY_WINDOW_OVERLAP = 64
+# Optional lexicon file (one term per line, '#' comments) replacing the
+# built-in TOXIC_LEXICON; terms are normalized like the scanned text.
+TOXIC_LEXICON_PATH = None
+# Per-sentence toxicity results, keyed by whitespace-normalized sentence hash.
+TOXICITY_CACHE_SIZE = 100000
+# Skip the model for: "off" - nothing; "trivial" - sentences shorter than
+# TOXICITY_GATE_MIN_CHARS or without letters; "lexical" - also sentences with
+# no lexicon or threat-pattern hit. Skipped sentences score 0.
+TOXICITY_GATING = "off"
+TOXICITY_GATE_MIN_CHARS = 12
+
 # PDF / OCR
 OCR_ZOOM = 2.0
+# Zooms tried in turn for a scanned page: the next, sharper render only when the
+# mean word confidence stays below OCR_CONF_THRESHOLD. (OCR_ZOOM,) renders once.
+OCR_ZOOM_LADDER = (1.5, OCR_ZOOM, 3.0)
+# Denoise (non-local means) only pages whose estimated noise std, in grey
+# levels, is above this.
+OCR_DENOISE_SIGMA = 3.0
+OCR_NOISE_MIN_PX = 32   # smallest central quarter of a scan image (px a side) to estimate noise on
+# On-disk OCR results keyed by page content and OCR settings, shared by the
+# extraction workers; e.g. Path("rc_cache/ocr.sqlite"). Least recently used
+# pages go first once the stored results exceed OCR_CACHE_MAX_BYTES.
+OCR_CACHE_PATH = None
+OCR_CACHE_MAX_BYTES = 512 * 1024 * 1024
 OCR_LANG = "eng"
 OCR_CONF_THRESHOLD = 30.0
+# Page extraction / OCR processes: 1 = serial, 0 = one per CPU. Each worker
+# opens the PDF itself and takes PDF_PAGES_PER_TASK pages at a time.
+PDF_WORKERS = 1
+PDF_PAGES_PER_TASK = 4
 
 # Risk thresholds
 RISK_LEVEL_THRESHOLDS = {"high": 0.7, "medium": 0.4}
 
+# Whole-document classify_pdf results keyed by the file's SHA-256 and a
+# fingerprint of the settings, corpus and code; e.g.
+# Path("rc_cache/verdicts.sqlite"). `python -m risk_classifier.verdict_cache`
+# lists and prunes it.
+VERDICT_CACHE_PATH = None
+VERDICT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 OUT_DIR = Path("rc_outputs")
 OUT_DIR.mkdir(exist_ok=True)
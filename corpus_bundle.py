@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+from .config import INDEX_BUNDLE_PATH, RETRIEVER_REVISION, SYN_CSV, AI_CHUNKS_CSV, GDPR_CHUNKS_CSV, EMBED_STORAGE
+from .compact import CompactMatrix
+
+# Corpus bundle written by `python -m risk_classifier.build_index`.
+# Layout: magic, uint64 header length, JSON header, then every array as raw
+# bytes at a 64-byte aligned offset. Arrays are opened with np.memmap, so
+# opening is cheap and worker processes share the same page-cache pages. The
+# FAISS index sits next to it in <bundle>.<content hash>.faiss, named in the
+# header, and is memory-mapped the same way.
+BUNDLE_MAGIC = b"RCBUNDLE"
+BUNDLE_FORMAT_VERSION = 1
+_ALIGN = 64
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def _stat(p):
+    # [size, mtime_ns], or None when missing
+    if not p.is_file():
+        return None
+    st = p.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+def source_stats():
+    return {Path(p).name: _stat(Path(p)) for p in (SYN_CSV, AI_CHUNKS_CSV, GDPR_CHUNKS_CSV)}
+
+def source_fingerprint(header=None):
+    # sha256 of each source CSV, None when missing. A CSV whose size and mtime
+    # match the bundle header's source_stats takes the recorded hash instead of
+    # being re-read, so a cold start does not hash the corpus.
+    stats = (header or {}).get("source_stats") or {}
+    recorded = (header or {}).get("sources") or {}
+    out = {}
+    for p in map(Path, (SYN_CSV, AI_CHUNKS_CSV, GDPR_CHUNKS_CSV)):
+        st = _stat(p)
+        if st is not None and st == stats.get(p.name) and recorded.get(p.name):
+            out[p.name] = recorded[p.name]
+        else:
+            out[p.name] = hashlib.sha256(p.read_bytes()).hexdigest() if st is not None else None
+    return out
+
+def write_bundle(path, arrays, meta):
+    path = Path(path)
+    layout = {}
+    offset = 0
+    digest = hashlib.sha256()
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        arrays[name] = arr
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        digest.update(name.encode("utf-8"))
+        digest.update(arr.dtype.str.encode("ascii"))
+        digest.update(arr.tobytes())
+        offset = _aligned(offset + arr.nbytes)
+    digest.update(json.dumps(meta, sort_keys=True).encode("utf-8"))
+    header = dict(meta)
+    header.update({"format_version": BUNDLE_FORMAT_VERSION, "bundle_version": digest.hexdigest()[:16],
+                   "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "arrays": layout})
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _aligned(len(BUNDLE_MAGIC) + 8 + len(header_bytes))
+
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(arr.tobytes())
+    # replace atomically; processes that already mapped the old file keep it
+    os.replace(tmp, path)
+    return header
+
+def write_index_file(index, bundle_path):
+    # -> file name, relative to the bundle's directory
+    import faiss
+    bundle_path = Path(bundle_path)
+    tmp = bundle_path.with_name(bundle_path.name + f".{os.getpid()}.faiss.tmp")
+    faiss.write_index(index, str(tmp))
+    h = hashlib.sha256()
+    with open(tmp, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    path = bundle_path.with_name(f"{bundle_path.name}.{h.hexdigest()[:16]}.faiss")
+    os.replace(tmp, path)
+    return path.name
+
+def remove_stale_index_files(bundle_path, keep):
+    # processes that still map an old file keep their pages until they exit
+    bundle_path = Path(bundle_path)
+    for p in bundle_path.parent.glob(bundle_path.name + ".*.faiss"):
+        if p.name != keep:
+            p.unlink()
+
+def read_bundle(path):
+    path = Path(path)
+    with open(path, "rb") as f:
+        if f.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+            raise ValueError(f"{path} is not a corpus bundle")
+        header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    if header.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {header.get('format_version')}")
+    data_start = _aligned(len(BUNDLE_MAGIC) + 8 + header_len)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=data_start + spec["offset"], shape=shape)
+    return header, arrays
+
+class CorpusBundle:
+    def __init__(self, path, header, arrays):
+        self.path = Path(path)
+        self.header = header
+        self.arrays = arrays
+
+    @property
+    def version(self):
+        return self.header.get("bundle_version")
+
+    @property
+    def syn_emb(self):
+        return CompactMatrix(self.arrays["syn_emb"], self.arrays.get("syn_emb_scales"))
+
+    @property
+    def chunk_embs(self):
+        return CompactMatrix(self.arrays["chunk_emb"], self.arrays.get("chunk_emb_scales"))
+
+    def syn_texts(self):
+        buf, offsets = self.arrays["syn_text_buf"], self.arrays["syn_text_offsets"]
+        return [buf[a:b].tobytes().decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def bm25(self):
+        if "bm25_terms" not in self.arrays:
+            return None
+        from .lexical import BM25Index
+        return BM25Index.from_arrays(self.arrays)
+
+    def doc_store(self):
+        from .data_manager import DocStore
+        a = self.arrays
+        return DocStore(policy_ids=a["policy_ids"], risk_codes=a["risk_codes"], risk_categories=a["risk_categories"],
+                        base_codes=a["base_codes"], base_ids=a["base_ids"], text_buf=a["text_buf"],
+                        text_offsets=a["text_offsets"], syn_policy_idx=a["syn_policy_idx"])
+
+    def faiss_index(self, index_type):
+        # None if the bundle has no index or was built with another index type
+        name = self.header.get("faiss_index_file")
+        blob = self.arrays.get("faiss_index")
+        if name is None and (blob is None or len(blob) == 0):
+            return None
+        if self.header.get("index_type", "flat") != index_type:
+            print(f"[WARN] Corpus bundle holds a {self.header.get('index_type', 'flat')} index, config wants {index_type}.")
+            return None
+        from .vector_index import load_index, set_search_params
+        if name is not None:
+            path = self.path.with_name(name)
+            if not path.exists():
+                print(f"[WARN] Index file {path} of corpus bundle {self.path} is missing. Re-run build_index.")
+                return None
+            return load_index(path, mmap=True)
+        # older bundles embed the serialized index: every process gets its own copy
+        import faiss
+        return set_search_params(faiss.deserialize_index(np.asarray(blob)))
+
+def load_bundle(path=INDEX_BUNDLE_PATH):
+    # Returns a CorpusBundle, or None when there is no usable bundle
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        header, arrays = read_bundle(path)
+    except Exception as e:
+        print(f"[WARN] Ignoring corpus bundle {path}: {e}")
+        return None
+    from .search_engine import retriever_cache_name
+    if (header.get("retriever_model"), header.get("retriever_revision")) != (retriever_cache_name(), RETRIEVER_REVISION):
+        print(f"[WARN] Corpus bundle {path} was built for {header.get('retriever_model')}; falling back to CSVs.")
+        return None
+    if header.get("embed_storage", "float32") != EMBED_STORAGE:
+        print(f"[WARN] Corpus bundle {path} stores {header.get('embed_storage', 'float32')} embeddings, config wants {EMBED_STORAGE}; falling back to CSVs.")
+        return None
+    # A missing CSV trusts the bundle, so a deployment can ship the bundle
+    # without the CSVs; a present one must hash to what the bundle was built from.
+    current, recorded = source_fingerprint(header), header.get("sources") or {}
+    changed = [name for name, digest in current.items() if digest is not None and digest != recorded.get(name)]
+    if changed:
+        print(f"[WARN] Source CSVs {', '.join(changed)} changed since {path} was built; falling back to CSVs. Re-run build_index.")
+        return None
+    missing = [name for name, digest in current.items() if digest is None]
+    if missing:
+        print(f"Source CSVs {', '.join(missing)} not found; using corpus bundle {path} as built.")
+    print(f"Opened corpus bundle {path} (version {header.get('bundle_version')}).")
+    return CorpusBundle(path, header, arrays)
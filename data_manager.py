@@ -1,41 +1,157 @@
+import hashlib
+import numpy as np
 import pandas as pd
 import sys
 from .config import SYN_CSV, AI_CHUNKS_CSV, GDPR_CHUNKS_CSV
 from .utils import safe_read_csv, choose_text_col
 
-print("Loading CSVs...")
-syn = safe_read_csv(SYN_CSV)
-ai_chunks = safe_read_csv(AI_CHUNKS_CSV)
-gdpr_chunks = safe_read_csv(GDPR_CHUNKS_CSV)
-
-if syn.empty or (ai_chunks.empty and gdpr_chunks.empty):
-    print("One or more required CSVs are missing or empty. Place files and re-run.")
-    # We won't exit here to allow importing for inspection, but functionality will be broken.
-
-syn_text_col = choose_text_col(syn) if not syn.empty else None
-if not syn.empty and syn_text_col:
-    syn = syn.rename(columns={syn_text_col: "simple_question"})
-    if "policy_id" not in syn.columns:
-        print("[ERROR] synthetic CSV must have a 'policy_id' column mapping to chunk ids.")
-
-chunks = pd.concat([ai_chunks, gdpr_chunks], ignore_index=True).fillna("")
-chunk_text_col = choose_text_col(chunks) if not chunks.empty else None
-if not chunks.empty and chunk_text_col:
-    chunks = chunks.rename(columns={chunk_text_col: "snippet_text"})
-    if "policy_id" not in chunks.columns:
-         print("[ERROR] chunk CSVs must contain 'policy_id' column.")
-    if "risk_category" not in chunks.columns:
-        chunks["risk_category"] = chunks.get("risk_category", "")
-
-doc_store = {}
-if not chunks.empty:
-    for _, r in chunks.iterrows():
-        pid = str(r.get("policy_id", ""))
-        if not pid: continue
-        doc_store[pid] = {
-            "snippet_text": str(r.get("snippet_text", "")),
-            "risk_category": str(r.get("risk_category","")),
-            "base_id": "_".join(pid.split("_")[:4]) if "_" in pid else pid
+# Columnar chunk store. Row i describes policy_ids[i]; categorical columns are
+# stored as integer codes and all snippet texts live in one UTF-8 buffer, so the
+# query path only does array gathers. Behaves like the old {policy_id: dict}
+# mapping for callers that still use .get()/[]/keys().
+class DocStore:
+    def __init__(self, policy_ids, risk_codes, risk_categories, base_codes, base_ids,
+                 text_buf, text_offsets, syn_policy_idx):
+        self.policy_ids = policy_ids
+        self.risk_codes = risk_codes
+        self.risk_categories = risk_categories
+        self.base_codes = base_codes
+        self.base_ids = base_ids
+        self.text_buf = text_buf
+        self.text_offsets = text_offsets
+        self.syn_policy_idx = syn_policy_idx
+        self.pid_to_idx = dict(zip(policy_ids.tolist(), range(len(policy_ids))))
+        self._policy_groups = None
+        self._text_digests = None
+
+    @classmethod
+    def empty(cls):
+        return cls(np.array([], dtype=str), np.array([], dtype=np.int32), np.array([], dtype=str),
+                   np.array([], dtype=np.int32), np.array([], dtype=str), np.array([], dtype=np.uint8),
+                   np.zeros(1, dtype=np.int64), np.array([], dtype=np.int32))
+
+    def __len__(self):
+        return len(self.policy_ids)
+
+    def __contains__(self, pid):
+        return pid in self.pid_to_idx
+
+    def __iter__(self):
+        return iter(self.policy_ids.tolist())
+
+    def keys(self):
+        return self.policy_ids.tolist()
+
+    def __getitem__(self, pid):
+        return self.row(self.pid_to_idx[pid])
+
+    def get(self, pid, default=None):
+        i = self.pid_to_idx.get(pid)
+        return default if i is None else self.row(i)
+
+    def indices(self, pids):
+        # -1 marks ids that are not in the store
+        get = self.pid_to_idx.get
+        return np.fromiter((get(pid, -1) for pid in pids), dtype=np.int64, count=len(pids))
+
+    def policy_groups(self):
+        # (row_order, starts, group_policy): synthetic rows sorted by policy so
+        # that np.maximum.reduceat(scores[:, row_order], starts) pools per policy.
+        if self._policy_groups is None:
+            rows = np.flatnonzero(self.syn_policy_idx >= 0)
+            row_order = rows[np.argsort(self.syn_policy_idx[rows], kind="stable")]
+            sorted_pidx = self.syn_policy_idx[row_order]
+            starts = np.flatnonzero(np.r_[True, sorted_pidx[1:] != sorted_pidx[:-1]]) if len(row_order) else np.array([], dtype=np.int64)
+            self._policy_groups = (row_order, starts, sorted_pidx[starts])
+        return self._policy_groups
+
+    def text(self, i):
+        return self.text_buf[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def text_digest(self, i):
+        # short content hash of snippet i, computed once for the whole store
+        if self._text_digests is None:
+            self._text_digests = [hashlib.blake2b(self.text_buf[a:b].tobytes(), digest_size=8).hexdigest()
+                                  for a, b in zip(self.text_offsets[:-1], self.text_offsets[1:])]
+        return self._text_digests[i]
+
+    def texts(self, idx=None):
+        idx = range(len(self)) if idx is None else idx
+        return [self.text(i) for i in idx]
+
+    def risk_category(self, i):
+        return str(self.risk_categories[self.risk_codes[i]])
+
+    def base_id(self, i):
+        return str(self.base_ids[self.base_codes[i]])
+
+    def row(self, i):
+        return {
+            "snippet_text": self.text(i),
+            "risk_category": self.risk_category(i),
+            "base_id": self.base_id(i)
         }
 
-print(f"Loaded {len(syn)} synthetic queries and {len(doc_store)} chunks.")
+def build_doc_store(chunks, syn):
+    if chunks.empty or "policy_id" not in chunks.columns:
+        return DocStore.empty()
+    pids = chunks["policy_id"].astype(str)
+    chunks = chunks.assign(policy_id=pids)[pids != ""]
+    # Same semantics as filling a dict row by row: the first occurrence of an id
+    # fixes its position, the last occurrence provides its values.
+    order = chunks["policy_id"].drop_duplicates(keep="first")
+    last = chunks.drop_duplicates("policy_id", keep="last").set_index("policy_id").reindex(order)
+
+    risk_codes, risk_categories = pd.factorize(last["risk_category"].astype(str))
+    base_codes, base_ids = pd.factorize(order.str.split("_").str[:4].str.join("_"))
+
+    encoded = last["snippet_text"].astype(str).str.encode("utf-8")
+    text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(encoded.str.len().to_numpy(), out=text_offsets[1:])
+    text_buf = np.frombuffer(b"".join(encoded.tolist()), dtype=np.uint8)
+
+    if "policy_id" in syn.columns:
+        syn_policy_idx = pd.Index(order).get_indexer(syn["policy_id"].astype(str)).astype(np.int32)
+    else:
+        syn_policy_idx = np.full(len(syn), -1, dtype=np.int32)
+
+    return DocStore(
+        policy_ids=order.to_numpy(dtype=str),
+        risk_codes=risk_codes.astype(np.int32),
+        risk_categories=np.asarray(risk_categories, dtype=str),
+        base_codes=base_codes.astype(np.int32),
+        base_ids=np.asarray(base_ids, dtype=str),
+        text_buf=text_buf,
+        text_offsets=text_offsets,
+        syn_policy_idx=syn_policy_idx
+    )
+
+def load_corpus():
+    print("Loading CSVs...")
+    syn = safe_read_csv(SYN_CSV)
+    ai_chunks = safe_read_csv(AI_CHUNKS_CSV)
+    gdpr_chunks = safe_read_csv(GDPR_CHUNKS_CSV)
+
+    if syn.empty or (ai_chunks.empty and gdpr_chunks.empty):
+        print("One or more required CSVs are missing or empty. Place files and re-run.")
+        # We won't exit here to allow importing for inspection, but functionality will be broken.
+
+    syn_text_col = choose_text_col(syn) if not syn.empty else None
+    if not syn.empty and syn_text_col:
+        syn = syn.rename(columns={syn_text_col: "simple_question"})
+        if "policy_id" not in syn.columns:
+            print("[ERROR] synthetic CSV must have a 'policy_id' column mapping to chunk ids.")
+
+    chunks = pd.concat([ai_chunks, gdpr_chunks], ignore_index=True).fillna("")
+    chunk_text_col = choose_text_col(chunks) if not chunks.empty else None
+    if not chunks.empty and chunk_text_col:
+        chunks = chunks.rename(columns={chunk_text_col: "snippet_text"})
+        if "policy_id" not in chunks.columns:
+             print("[ERROR] chunk CSVs must contain 'policy_id' column.")
+        if "risk_category" not in chunks.columns:
+            chunks["risk_category"] = chunks.get("risk_category", "")
+
+    doc_store = build_doc_store(chunks, syn)
+
+    print(f"Loaded {len(syn)} synthetic queries and {len(doc_store)} chunks.")
+    return syn, doc_store
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import re
+import numpy as np
+from .config import EMBED_CACHE_DIR, EMBED_STORAGE
+from .compact import CompactMatrix, compress
+
+# Content-addressed embedding cache. Each model (name + revision) gets its own
+# directory under EMBED_CACHE_DIR, so caches for several models live side by
+# side. Every named corpus is stored as <name>.npy plus <name>.keys.npy, which
+# holds a hash of the text behind each row; only new or edited texts are
+# re-encoded. With EMBED_STORAGE float16/int8 a compact copy is kept next to
+# it (<name>.<storage>.npy, .scales.npy, .keys.npy) and that is what gets
+# memory-mapped at runtime; the float32 file stays the source for updates.
+
+def text_hashes(texts):
+    return np.array([hashlib.blake2b(str(t).encode("utf-8"), digest_size=16).digest() for t in texts], dtype="S16")
+
+def model_cache_dir(model_name, revision=None):
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "--", str(model_name))
+    if revision:
+        slug += "@" + re.sub(r"[^A-Za-z0-9_.-]+", "--", str(revision))
+    d = EMBED_CACHE_DIR / slug
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+def _save_atomic(path, arr):
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+def load_cached(name, model_name, revision=None):
+    # Returns (vectors, keys) for the stored rows, or (None, None)
+    d = model_cache_dir(model_name, revision)
+    vec_path, key_path = d / f"{name}.npy", d / f"{name}.keys.npy"
+    if not (vec_path.exists() and key_path.exists()):
+        return None, None
+    try:
+        vecs, keys = np.load(vec_path, mmap_mode="r"), np.load(key_path)
+        if vecs.shape[0] != keys.shape[0]:
+            raise ValueError("Size mismatch")
+        return vecs, keys
+    except Exception as e:
+        print(f"[WARN] Ignoring unreadable embedding cache {vec_path}: {e}")
+        return None, None
+
+def _same_keys(a, b):
+    return a is not None and a.shape == b.shape and np.array_equal(a, b)
+
+def load_compact(name, model_name, revision, keys, storage):
+    # CompactMatrix for exactly these keys, or None
+    d = model_cache_dir(model_name, revision)
+    stem = d / f"{name}.{storage}"
+    paths = [stem.with_name(stem.name + s) for s in (".npy", ".keys.npy", ".scales.npy")]
+    if not (paths[0].exists() and paths[1].exists()):
+        return None
+    try:
+        if not _same_keys(np.load(paths[1]), keys):
+            return None
+        data = np.load(paths[0], mmap_mode="r")
+        scales = np.load(paths[2]) if storage == "int8" else None
+        return CompactMatrix(data, scales)
+    except Exception as e:
+        print(f"[WARN] Ignoring unreadable embedding cache {paths[0]}: {e}")
+        return None
+
+def _save_compact(vecs, name, model_name, revision, keys, storage):
+    m = compress(vecs, storage)
+    stem = model_cache_dir(model_name, revision) / f"{name}.{storage}"
+    _save_atomic(stem.with_name(stem.name + ".npy"), m.data)
+    if m.scales is not None:
+        _save_atomic(stem.with_name(stem.name + ".scales.npy"), m.scales)
+    _save_atomic(stem.with_name(stem.name + ".keys.npy"), keys)
+    return load_compact(name, model_name, revision, keys, storage)
+
+def encode_cached(embedder, texts, name, model_name, revision=None, show_progress_bar=True, storage=EMBED_STORAGE):
+    # Returns a CompactMatrix in the requested storage, memory-mapped from the cache
+    texts = [str(t) for t in texts]
+    if not texts:
+        return CompactMatrix.empty()
+    keys = text_hashes(texts)
+    if storage != "float32":
+        m = load_compact(name, model_name, revision, keys, storage)
+        if m is not None:
+            print(f"Loaded {name} embeddings from cache ({model_name}, {storage}).")
+            return m
+    old_vecs, old_keys = load_cached(name, model_name, revision)
+    if _same_keys(old_keys, keys):
+        print(f"Loaded {name} embeddings from cache ({model_name}).")
+        if storage == "float32":
+            return CompactMatrix(old_vecs)
+        return _save_compact(old_vecs, name, model_name, revision, keys, storage)
+
+    old_rows = dict(zip(old_keys.tolist(), range(len(old_keys)))) if old_keys is not None else {}
+    rows = np.fromiter((old_rows.get(k, -1) for k in keys.tolist()), dtype=np.int64, count=len(keys))
+    missing = np.flatnonzero(rows < 0)
+    if len(missing):
+        # identical texts are encoded once
+        uniq_keys, first, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+        print(f"Encoding {len(uniq_keys)} new or changed {name} texts ({len(texts) - len(missing)} reused from cache)...")
+        fresh = embedder.encode([texts[missing[i]] for i in first], convert_to_numpy=True,
+                                normalize_embeddings=True, show_progress_bar=show_progress_bar)
+        fresh = np.asarray(fresh, dtype=np.float32)
+        dim = fresh.shape[1]
+    else:
+        print(f"Reordering {len(texts)} cached {name} embeddings...")
+        dim = old_vecs.shape[1]
+
+    vecs = np.empty((len(texts), dim), dtype=np.float32)
+    if len(missing) < len(texts):
+        vecs[rows >= 0] = old_vecs[rows[rows >= 0]]
+    if len(missing):
+        vecs[missing] = fresh[inverse.reshape(-1)]
+    # old_vecs maps the file being replaced, which Windows refuses while it is open
+    del old_vecs
+
+    d = model_cache_dir(model_name, revision)
+    _save_atomic(d / f"{name}.npy", vecs)
+    _save_atomic(d / f"{name}.keys.npy", keys)
+    if storage == "float32":
+        return CompactMatrix(np.load(d / f"{name}.npy", mmap_mode="r"))
+    return _save_compact(vecs, name, model_name, revision, keys, storage)
@@ -0,0 +1,544 @@
+import threading
+import time
+import json
+import numpy as np
+from .config import (TOP_K, RERANK_TOP, SIM_THRESHOLD, DOC_SIGNALS, DOC_RETRIEVAL_PASS, STREAM_MAX_CONTEXTS, STREAM_DOC_CHARS,
+                     PII_STREAM_OVERLAP, RISK_LEVEL_THRESHOLDS, QUERY_TOP_K, OUT_DIR,
+                     QUERY_EMB_CACHE_SIZE, INDEX_TYPE, RERANK_CACHE_SIZE, RERANK_CACHE_PATH, RERANK_CACHE_MAX_ENTRIES,
+                     ENCODE_BATCH_SIZE, TOXICITY_CACHE_SIZE, MICROBATCH_ENABLED, MICROBATCH_MAX_ITEMS, MICROBATCH_MAX_WAIT_MS,
+                     VERDICT_CACHE_PATH, SPARSE_MODE)
+from .caches import LRUCache, SqliteCache
+from .compact import describe
+from .vector_index import FaissIndex, resolve_backend
+from .batching import MicroBatcher
+from .utils import detect_pii
+from .pii import seam_pii
+from .data_manager import load_corpus
+from .toxicity import load_toxicity_clf, detect_toxicity_spans, run_toxicity, summarize_spans
+from .pdf_processor import extract_text_from_pdf, iter_pages, ocr_cache
+from .corpus_bundle import load_bundle
+from .verdict_cache import (open_verdict_cache, config_fingerprint, file_sha256, verdict_key, encode_verdict,
+                            decode_verdict)
+from .lexical import build_bm25_for_store
+from .search_engine import (load_embedder, load_reranker, load_syn_embeddings, load_chunk_embeddings,
+                            build_vector_index, retrieve_candidate_chunk_ids, rerank_chunks_with_probs,
+                            encode_texts, predict_pairs)
+from .risk_assessment import score_to_severity, aggregate_document_risk
+
+def get_violated_act_name(base_id):
+    if not base_id:
+        return None
+    if base_id.startswith("EU_AI_Act"):
+        return "EU AI Act"
+    if base_id.startswith("GDPR"):
+        return "GDPR"
+    return base_id
+
+def record_match(violations, match, page_num=None, context_text=None, max_contexts=None):
+    # merge one reranked match into violations {policy_id: info}
+    pid = match.get("policy_id")
+    if not pid:
+        return
+    cur = violations.get(pid)
+    score = float(match.get("combined_score", 0.0))
+    if cur is None:
+        violations[pid] = {
+            "policy_id": pid,
+            "base_id": match.get("base_id"),
+            "risk_category": match.get("risk_category"),
+            "best_score": score,
+            "occurrences": 1,
+            "pages": [page_num] if page_num is not None else [],
+            "contexts": [context_text] if context_text else [match.get("snippet_text","")]
+        }
+    else:
+        cur["occurrences"] += 1
+        if score > cur["best_score"]:
+            cur["best_score"] = score
+        if page_num is not None and page_num not in cur["pages"]:
+            cur["pages"].append(page_num)
+        if context_text and (max_contexts is None or len(cur["contexts"]) < max_contexts):
+            cur["contexts"].append(context_text)
+
+# Owns the corpus, models and index; each one is loaded on first use.
+# warmup() loads everything up front (e.g. before forking workers) and
+# startup_report() breaks the load time down by stage. When a corpus bundle
+# exists the corpus, embeddings and index are mapped from it instead of being
+# rebuilt from the CSVs.
+class RiskEngine:
+    STAGES = ("bundle", "corpus", "embedder", "syn_emb", "index", "bm25", "reranker", "chunk_embs", "toxicity_clf")
+    DENSE_STAGES = ("embedder", "syn_emb", "index", "chunk_embs")   # never used with SPARSE_MODE="sparse"
+
+    def __init__(self):
+        self._resources = {}
+        self._lock = threading.RLock()
+        self.timings = {}
+        self.query_emb_cache = LRUCache(QUERY_EMB_CACHE_SIZE)
+        self.rerank_cache = LRUCache(RERANK_CACHE_SIZE)
+        self.toxicity_cache = LRUCache(TOXICITY_CACHE_SIZE)
+        self.counters = {}
+        self._counter_lock = threading.Lock()
+
+    def _load(self, stage, loader):
+        if stage not in self._resources:
+            with self._lock:
+                if stage not in self._resources:
+                    t0 = time.perf_counter()
+                    self._resources[stage] = loader()
+                    self.timings[stage] = time.perf_counter() - t0
+        return self._resources[stage]
+
+    def is_loaded(self, stage):
+        return stage in self._resources
+
+    @property
+    def bundle(self):
+        return self._load("bundle", load_bundle)
+
+    @property
+    def corpus(self):
+        bundle = self.bundle
+        if bundle is not None:
+            return self._load("corpus", lambda: (None, bundle.doc_store()))
+        return self._load("corpus", load_corpus)
+
+    @property
+    def syn(self):
+        return self.corpus[0]
+
+    def syn_texts(self):
+        # the synthetic questions, in row order; syn is None with a bundle
+        if self.bundle is not None:
+            return self.bundle.syn_texts()
+        syn = self.syn
+        return syn["simple_question"].astype(str).tolist() if "simple_question" in syn.columns else []
+
+    @property
+    def doc_store(self):
+        return self.corpus[1]
+
+    @property
+    def chunk_ids(self):
+        return self.doc_store.keys()
+
+    @property
+    def embedder(self):
+        return self._load("embedder", load_embedder)
+
+    @property
+    def syn_emb(self):
+        if not self.is_loaded("syn_emb"):
+            if self.bundle is not None:
+                return self._load("syn_emb", lambda: self.bundle.syn_emb)
+            embedder, syn = self.embedder, self.syn
+        return self._load("syn_emb", lambda: load_syn_embeddings(embedder, syn))
+
+    @property
+    def index(self):
+        if not self.is_loaded("index"):
+            syn_emb = self.syn_emb
+        return self._load("index", lambda: self._open_index(syn_emb))
+
+    def _open_index(self, syn_emb):
+        if self.bundle is not None and resolve_backend(syn_emb.storage) != "numpy":
+            try:
+                faiss_index = self.bundle.faiss_index(INDEX_TYPE)
+            except ImportError:
+                faiss_index = None
+            if faiss_index is not None:
+                print("Loaded FAISS index from corpus bundle.")
+                return FaissIndex(faiss_index)
+        return build_vector_index(syn_emb)
+
+    @property
+    def bm25(self):
+        return self._load("bm25", self._open_bm25)
+
+    def _open_bm25(self):
+        bundle = self.bundle
+        if bundle is not None:
+            bm25 = bundle.bm25()
+            if bm25 is not None:
+                return bm25
+        bm25 = build_bm25_for_store(self.doc_store, self.syn_texts())
+        print(f"Built BM25 index over {len(bm25.doc_len)} policies ({len(bm25.terms)} terms).")
+        return bm25
+
+    @property
+    def reranker(self):
+        return self._load("reranker", load_reranker)
+
+    @property
+    def chunk_embs(self):
+        if not self.is_loaded("chunk_embs"):
+            if self.bundle is not None:
+                return self._load("chunk_embs", lambda: self.bundle.chunk_embs)
+            embedder, doc_store = self.embedder, self.doc_store
+        return self._load("chunk_embs", lambda: load_chunk_embeddings(embedder, doc_store))
+
+    @property
+    def rerank_disk_cache(self):
+        if RERANK_CACHE_PATH is None:
+            return None
+        return self._load("rerank_disk_cache", lambda: SqliteCache(RERANK_CACHE_PATH, max_entries=RERANK_CACHE_MAX_ENTRIES))
+
+    @property
+    def verdict_cache(self):
+        if VERDICT_CACHE_PATH is None:
+            return None
+        return self._load("verdict_cache", lambda: open_verdict_cache(VERDICT_CACHE_PATH))
+
+    @property
+    def verdict_fingerprint(self):
+        # computed once: the engine also loads its corpus and models once
+        return self._load("verdict_fingerprint", config_fingerprint)
+
+    @property
+    def toxicity_clf(self):
+        return self._load("toxicity_clf", load_toxicity_clf)
+
+    # Model calls on the request path. With MICROBATCH_ENABLED, concurrent
+    # callers are merged into one batch per model by a MicroBatcher.
+    def _batcher(self, name, fn):
+        return self._load(name, lambda: MicroBatcher(fn, MICROBATCH_MAX_ITEMS, MICROBATCH_MAX_WAIT_MS, name))
+
+    def encode_queries(self, texts, batch_size=ENCODE_BATCH_SIZE):
+        if MICROBATCH_ENABLED:
+            return self._batcher("encode_batcher", lambda items: encode_texts(self.embedder, items)).submit(texts)
+        return encode_texts(self.embedder, texts, batch_size)
+
+    def predict_pairs(self, pairs):
+        if MICROBATCH_ENABLED:
+            return self._batcher("rerank_batcher", lambda items: predict_pairs(self.reranker, items)).submit(pairs)
+        return predict_pairs(self.reranker, pairs)
+
+    def classify_toxicity(self, texts):
+        if MICROBATCH_ENABLED:
+            return self._batcher("toxicity_batcher", lambda items: run_toxicity(self.toxicity_clf, items)).submit(texts)
+        return run_toxicity(self.toxicity_clf, texts)
+
+    def batcher_stats(self):
+        names = ("encode_batcher", "rerank_batcher", "toxicity_batcher")
+        return {n: self._resources[n].stats() for n in names if self.is_loaded(n)}
+
+    def warmup(self, stages=None):
+        if stages is None:
+            stages = [s for s in self.STAGES if SPARSE_MODE != "sparse" or s not in self.DENSE_STAGES]
+        for stage in stages:
+            if stage not in self.STAGES:
+                raise ValueError(f"Unknown stage: {stage}")
+            getattr(self, stage)
+        return self.startup_report()
+
+    def count(self, name, n=1):
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def cache_stats(self):
+        stats = {"query_embeddings": self.query_emb_cache.stats(), "rerank_scores": self.rerank_cache.stats(),
+                 "toxicity_sentences": self.toxicity_cache.stats()}
+        if self.is_loaded("rerank_disk_cache"):
+            stats["rerank_scores_disk"] = self.rerank_disk_cache.stats()
+        if self.is_loaded("verdict_cache") and self.verdict_cache is not None:
+            stats["verdicts_disk"] = self.verdict_cache.stats()
+        if ocr_cache() is not None:
+            # hits / misses count this process only; workers keep their own
+            stats["ocr_pages_disk"] = ocr_cache().stats()
+        return stats
+
+    def memory_report(self):
+        # footprint of the loaded embedding matrices / index vs. plain float32
+        report = [describe(name, self._resources[name]) for name in ("syn_emb", "chunk_embs") if self.is_loaded(name)]
+        if self.is_loaded("index"):
+            index = self.index
+            if index is not None:
+                # the numpy backend searches syn_emb in place
+                storage = type(index.index).__name__ if isinstance(index, FaissIndex) else index.backend
+                report.append({"name": "index", "storage": storage, "shape": list(self.syn_emb.shape),
+                               "bytes": index.nbytes, "float32_bytes": int(np.prod(self.syn_emb.shape)) * 4})
+        return report
+
+    def startup_report(self):
+        stages = {s: round(self.timings[s], 4) for s in self.STAGES if s in self.timings}
+        return {"stages": stages, "total_s": round(sum(stages.values()), 4),
+                "pending": [s for s in self.STAGES if s not in self.timings]}
+
+    def _fallback_candidates(self, chunk_ids):
+        # Every chunk when retrieval found nothing. Not in sparse mode: no BM25
+        # hit means no shared term with any policy, so that is "no match"
+        # rather than a cross-encoder pass over the whole corpus.
+        if SPARSE_MODE == "sparse" or not chunk_ids:
+            return []
+        return chunk_ids.copy()
+
+    def _page_result(self, p, top_k, violations, chunk_ids, max_contexts=None):
+        # -> (evidence, pii types, toxicity spans) for one extracted page
+        text = p.get('text','').strip()
+        if not text:
+            return {
+                "page_num": p['page_num'],
+                "is_selectable": p['is_selectable'],
+                "pii": [],
+                "safety_summary": {"notice":"green","message":"No text"},
+                "top_matches": []
+            }, [], []
+        pii_page = detect_pii(text)
+        spans_page, safety_summary_page = detect_toxicity_spans(text, engine=self)
+        cand = retrieve_candidate_chunk_ids(text, top_k=top_k, engine=self)
+        if not cand:
+            cand = self._fallback_candidates(chunk_ids)
+        reranked_page = rerank_chunks_with_probs(text, cand, top_n=RERANK_TOP, engine=self)
+        for m in reranked_page:
+            record_match(violations, m, page_num=p['page_num'], context_text=text[:400], max_contexts=max_contexts)
+        return {
+            "page_num": p['page_num'],
+            "is_selectable": p['is_selectable'],
+            "pii": pii_page,
+            "safety_summary": safety_summary_page,
+            "top_matches": reranked_page,
+            "ocr_boxes": p.get('ocr_boxes')
+        }, pii_page, spans_page
+
+    def _doc_retrieval_pass(self, text, top_k, violations, max_contexts=None):
+        # recall only: policies no page matched, reranked like any page match
+        if not (DOC_RETRIEVAL_PASS and text.strip()):
+            return
+        cand = [c for c in retrieve_candidate_chunk_ids(text, top_k=top_k, engine=self) if c not in violations]
+        for m in rerank_chunks_with_probs(text, cand, top_n=RERANK_TOP, engine=self):
+            record_match(violations, m, page_num=None, context_text=m.get("snippet_text"), max_contexts=max_contexts)
+
+    def classify_pdf(self, pdf_path, run_per_page=True, top_k=TOP_K):
+        start_time = time.time()
+        cache = self.verdict_cache
+        if cache is not None:
+            key = verdict_key(file_sha256(pdf_path), self.verdict_fingerprint, run_per_page=run_per_page, top_k=top_k)
+            hit = cache.get(key)
+            if hit is not None:
+                out = decode_verdict(hit)
+                out.update(source=str(pdf_path), cached=True, duration_s=time.time() - start_time)
+                print("Verdict cache hit for", pdf_path)
+                return out
+        # Ensure chunk_ids is available even if search_engine failed slightly or is empty
+        current_chunk_ids = self.chunk_ids
+
+        pages = extract_text_from_pdf(pdf_path)
+        full_text = "\n\n".join([p['text'] for p in pages if p['text']])
+
+        # in "pages" mode the document-level signals come from the page results
+        derive = run_per_page and DOC_SIGNALS == "pages"
+
+        violations = {}
+        if not derive:
+            pii_doc = detect_pii(full_text)
+            spans_doc, safety_summary_doc = detect_toxicity_spans(full_text, engine=self)
+
+            candidate_ids_doc = retrieve_candidate_chunk_ids(full_text, top_k=top_k, engine=self)
+            # if no candidate ids (rare), use all chunk_ids
+            if not candidate_ids_doc:
+                candidate_ids_doc = self._fallback_candidates(current_chunk_ids)
+
+            reranked_doc = rerank_chunks_with_probs(full_text, candidate_ids_doc, top_n=RERANK_TOP, engine=self)
+            for m in reranked_doc:
+                record_match(violations, m, page_num=None, context_text=m.get("snippet_text"))
+
+        page_evidence = []
+        page_pii, page_spans = [], []
+        if run_per_page:
+            for p in pages:
+                evidence, pii_page, spans_page = self._page_result(p, top_k, violations, current_chunk_ids)
+                page_pii.extend(pii_page)
+                page_spans.extend(spans_page)
+                page_evidence.append(evidence)
+
+        if derive:
+            texts = [p['text'] for p in pages if p['text']]
+            for left, right in zip(texts, texts[1:]):
+                page_pii.extend(sp["type"] for sp in seam_pii(left, right))
+            pii_doc = list(set(page_pii))
+            safety_summary_doc = summarize_spans(page_spans)
+            self._doc_retrieval_pass(full_text, top_k, violations)
+        out = self._pdf_verdict(pdf_path, len(pages), violations, pii_doc, safety_summary_doc, page_evidence, start_time)
+        if cache is not None:
+            cache.put(key, encode_verdict(out))
+            # few, large entries: keep the size cap on every write
+            cache.evict()
+            out["cached"] = False
+        return out
+
+    def iter_classify_pdf(self, pdf_path, top_k=TOP_K):
+        # Streaming classify_pdf: yields ("page", evidence) as soon as each page
+        # is scored, then ("document", verdict). Only running state is kept, so
+        # memory does not grow with the page count: document signals are
+        # derived from the pages (as with DOC_SIGNALS = "pages"), the verdict
+        # has no page_evidence, each policy keeps its first STREAM_MAX_CONTEXTS
+        # contexts and the retrieval pass sees the first STREAM_DOC_CHARS chars.
+        start_time = time.time()
+        current_chunk_ids = self.chunk_ids
+        violations = {}
+        pii_doc, categories = set(), set()
+        n_spans, max_score = 0, 0.0
+        head, tail, num_pages = "", "", 0
+        for p in iter_pages(pdf_path):
+            num_pages += 1
+            evidence, pii_page, spans_page = self._page_result(p, top_k, violations, current_chunk_ids,
+                                                               max_contexts=STREAM_MAX_CONTEXTS)
+            pii_doc.update(pii_page)
+            for sp in spans_page:
+                categories.update(sp['categories'])
+                max_score = max(max_score, sp['ml_score'])
+            n_spans += len(spans_page)
+            text = p['text']
+            if text:
+                if tail:
+                    pii_doc.update(sp["type"] for sp in seam_pii(tail, text))
+                tail = text[-PII_STREAM_OVERLAP:]
+                if len(head) < STREAM_DOC_CHARS:
+                    head = (head + "\n\n" + text if head else text)[:STREAM_DOC_CHARS]
+            yield "page", evidence
+
+        # one span carrying the union of categories and the max score summarizes
+        # the same as all of them
+        safety_summary_doc = summarize_spans([{"categories": categories, "ml_score": max_score}] if n_spans else [])
+        self._doc_retrieval_pass(head, top_k, violations, max_contexts=STREAM_MAX_CONTEXTS)
+        yield "document", self._pdf_verdict(pdf_path, num_pages, violations, list(pii_doc), safety_summary_doc,
+                                            None, start_time)
+
+    def _pdf_verdict(self, pdf_path, num_pages, violations, pii_doc, safety_summary_doc, page_evidence, start_time):
+        doc_toxic_score = float(safety_summary_doc.get("doc_toxic_score", 0.0) if isinstance(safety_summary_doc, dict) else 0.0)
+
+        violations_list = []
+        for pid, info in violations.items():
+            violations_list.append({
+                "policy_id": pid,
+                "base_id": info.get("base_id"),
+                "risk_category": info.get("risk_category"),
+                "best_score": float(info.get("best_score",0.0)),
+                "occurrences": info.get("occurrences",0),
+                "pages": info.get("pages",[]),
+                "contexts": info.get("contexts",[])
+            })
+        violations_list.sort(key=lambda x: x["best_score"], reverse=True)
+        for v in violations_list:
+            v["violation_severity"] = score_to_severity(v["best_score"])
+
+        highest_policy_score = violations_list[0]["best_score"] if violations_list else 0.0
+        overall_confidence = max(highest_policy_score, doc_toxic_score)
+        overall_risk_level = aggregate_document_risk(violations_list, doc_toxic_score)
+        violations_above_threshold = [v for v in violations_list if v["best_score"] >= SIM_THRESHOLD]
+
+        counts = {"High":0,"Medium":0,"Low":0}
+        for v in violations_list:
+            counts[v.get("violation_severity","Low")] += 1
+        guideline_lines = []
+        guideline_lines.append(f"Detected {len(violations_list)} potential policy violations: {counts['High']} High, {counts['Medium']} Medium, {counts['Low']} Low.")
+        guideline_lines.append(f"Document toxicity score: {doc_toxic_score:.2f}.")
+        guideline_lines.append("Aggregation rule: if any violation is High -> document is High risk; else if majority of violations are Medium -> Medium risk; else Low risk.")
+        guideline_lines.append(f"Overall decision: {overall_risk_level} (confidence {overall_confidence:.2f}).")
+        sample_examples = []
+        for v in violations_list[:3]:
+            sample_examples.append(f"{v['policy_id']} ({v['violation_severity']}, score {v['best_score']:.2f}) - pages {v['pages']}")
+        if sample_examples:
+            guideline_lines.append("Examples: " + " | ".join(sample_examples))
+        guideline_text = " ".join(guideline_lines)
+
+        out = {
+            "source": str(pdf_path),
+            "num_pages": num_pages,
+            "violations_all": violations_list,
+            "violations_above_threshold": violations_above_threshold,
+            "num_violations": len(violations_list),
+            "num_violations_above_threshold": len(violations_above_threshold),
+            "overall_confidence": overall_confidence,
+            "risk_level": overall_risk_level,
+            "pii_detected_doc": pii_doc,
+            "safety_summary_doc": safety_summary_doc,
+            "page_evidence": page_evidence,
+            "guideline": {
+                "text": guideline_text,
+                "counts": counts,
+                "aggregation_rule": "any-High -> High; else majority-Medium -> Medium; else Low",
+                "examples": sample_examples
+            },
+            "duration_s": time.time() - start_time
+        }
+        if page_evidence is None:
+            # streamed: the pages were yielded one by one
+            del out["page_evidence"]
+
+        ts = int(time.time()*1000)
+        out_fname = OUT_DIR / f"pdf_match_{ts}.json"
+        with open(out_fname, 'w', encoding='utf-8') as f:
+            json.dump(out, f, indent=2, ensure_ascii=False)
+        print("Saved PDF match ->", out_fname)
+        return out
+
+    def match_query(self, query: str, query_top_k=QUERY_TOP_K):
+        start = time.time()
+        query = str(query).strip()
+        if not query:
+            return {"query": query, "decision": "no_input"}
+
+        pii_detected = detect_pii(query)
+        spans, safety_summary = detect_toxicity_spans(query, engine=self)
+        doc_toxic_score = float(safety_summary.get("doc_toxic_score", 0.0) if isinstance(safety_summary, dict) else 0.0)
+
+        candidate_ids = retrieve_candidate_chunk_ids(query, top_k=query_top_k, engine=self)
+        # fallback: if no candidate ids, use all chunk ids
+        if not candidate_ids:
+            candidate_ids = self._fallback_candidates(self.chunk_ids)
+
+        reranked_results = rerank_chunks_with_probs(query, candidate_ids, top_n=RERANK_TOP, engine=self)
+
+        result = {
+            "query": query,
+            "violated_act": None,
+            "policy_id": None,
+            "risk_category": "Low",
+            "confidence": 0.0,
+            "pii_detected": pii_detected,
+            "safety_summary": safety_summary,
+            "reason": "No direct policy violation detected.",
+            "duration_s": time.time() - start,
+            "decision": "Low",
+            "rerank_path": reranked_results[0]["rerank_path"] if reranked_results else None
+        }
+
+        if reranked_results:
+            top_match = reranked_results[0]
+            conf = float(top_match.get("combined_score", 0.0))
+            result["confidence"] = conf
+            result["policy_id"] = top_match.get("policy_id")
+            result["violated_act"] = get_violated_act_name(top_match.get("base_id"))
+            result["risk_category"] = top_match.get("risk_category")
+            result["reason"] = top_match.get("snippet_text")
+            # decision based on thresholds
+            if conf >= SIM_THRESHOLD:
+                result["decision"] = score_to_severity(conf)
+            else:
+                # if doc toxicity is higher, escalate
+                result["decision"] = score_to_severity(max(conf, doc_toxic_score))
+                # keep confidence as max of both
+                result["confidence"] = max(conf, doc_toxic_score)
+
+        # finalize: if toxicity alone is high and there was no policy match, escalate
+        if (result["confidence"] < RISK_LEVEL_THRESHOLDS["high"]) and doc_toxic_score >= RISK_LEVEL_THRESHOLDS["high"]:
+            result["decision"] = "High"
+            result["confidence"] = max(result["confidence"], doc_toxic_score)
+        elif (result["confidence"] < RISK_LEVEL_THRESHOLDS["medium"]) and doc_toxic_score >= RISK_LEVEL_THRESHOLDS["medium"]:
+            if result["decision"] == "Low":
+                result["decision"] = "Medium"
+                result["confidence"] = max(result["confidence"], doc_toxic_score)
+
+        result["duration_s"] = time.time() - start
+        return result
+
+_default_engine = None
+_default_lock = threading.Lock()
+
+def get_default_engine():
+    global _default_engine
+    if _default_engine is None:
+        with _default_lock:
+            if _default_engine is None:
+                _default_engine = RiskEngine()
+    return _default_engine
@@ -0,0 +1,110 @@
+import re
+import numpy as np
+from .config import BM25_K1, BM25_B, RRF_K
+
+# In-memory BM25 over policies. Each policy is one document made of its
+# snippet text, all of its synthetic questions and its policy id, so article
+# ids ("Art_5", "article 5") and terms like "biometric" match without the
+# embedder. Postings are stored CSR-style in NumPy arrays.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:_[a-z0-9]+)*")
+_ARTICLE_RE = re.compile(r"\bart(?:icle|\.)?\s*(\d+)", re.I)
+
+def tokenize(text, query=False):
+    text = str(text)
+    if query:
+        # "Article 5" / "Art. 5" in a query means the article id; in corpus
+        # text it is usually a cross-reference, so only queries are rewritten
+        text = _ARTICLE_RE.sub(r"art_\1", text)
+    text = text.lower()
+    tokens = []
+    for tok in _TOKEN_RE.findall(text):
+        tokens.append(tok)
+        if "_" in tok:
+            # EU_AI_Act_Art_5_1 -> parts and adjacent pairs (..., "art_5", "5_1")
+            parts = tok.split("_")
+            tokens.extend(parts)
+            tokens.extend(a + "_" + b for a, b in zip(parts, parts[1:]) if a + "_" + b != tok)
+    return tokens
+
+class BM25Index:
+    def __init__(self, terms, offsets, docs, tfs, doc_len, k1=BM25_K1, b=BM25_B):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1, self.b = k1, b
+        self.term_ids = dict(zip(terms.tolist(), range(len(terms))))
+        n = len(doc_len)
+        df = np.diff(offsets).astype(np.float64)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if n else 1.0
+        self.norm = (k1 * (1.0 - b + b * doc_len / max(avgdl, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, doc_texts):
+        # doc_texts: one string (or list of strings) per document
+        term_ids = {}
+        doc_col, term_col = [], []
+        doc_len = np.zeros(len(doc_texts), dtype=np.float32)
+        for d, parts in enumerate(doc_texts):
+            toks = tokenize(parts if isinstance(parts, str) else " ".join(parts))
+            doc_len[d] = len(toks)
+            ids = [term_ids.setdefault(t, len(term_ids)) for t in toks]
+            doc_col.append(np.full(len(ids), d, dtype=np.int64))
+            term_col.append(np.asarray(ids, dtype=np.int64))
+        doc_col = np.concatenate(doc_col) if doc_col else np.array([], dtype=np.int64)
+        term_col = np.concatenate(term_col) if term_col else np.array([], dtype=np.int64)
+        # (term, doc) pairs -> tf, sorted by term then doc
+        keys, tfs = np.unique(term_col * max(len(doc_texts), 1) + doc_col, return_counts=True)
+        terms_sorted = keys // max(len(doc_texts), 1)
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms_sorted, minlength=len(term_ids)), out=offsets[1:])
+        terms = np.array(sorted(term_ids, key=term_ids.get), dtype=str)
+        return cls(terms, offsets, (keys % max(len(doc_texts), 1)).astype(np.int32), tfs.astype(np.float32), doc_len)
+
+    def arrays(self):
+        return {"bm25_terms": self.terms, "bm25_offsets": self.offsets, "bm25_docs": self.docs,
+                "bm25_tfs": self.tfs, "bm25_doc_len": self.doc_len}
+
+    @classmethod
+    def from_arrays(cls, a):
+        return cls(a["bm25_terms"], a["bm25_offsets"], a["bm25_docs"], a["bm25_tfs"], a["bm25_doc_len"])
+
+    def scores(self, query):
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        for tok in set(tokenize(query, query=True)):
+            t = self.term_ids.get(tok)
+            if t is None:
+                continue
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            docs, tf = self.docs[lo:hi], self.tfs[lo:hi]
+            scores[docs] += self.idf[t] * tf * (self.k1 + 1.0) / (tf + self.norm[docs])
+        return scores
+
+    def search(self, query, top_n):
+        # -> (doc indices, scores), best first; documents scoring 0 are dropped
+        scores = self.scores(query)
+        n = min(top_n, int(np.count_nonzero(scores)))
+        if n == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+def rrf_fuse(rankings, k=RRF_K):
+    # reciprocal rank fusion of several ranked id lists
+    fused = {}
+    for ranking in rankings:
+        for rank, pid in enumerate(ranking):
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=lambda pid: -fused[pid])
+
+def build_bm25_for_store(doc_store, syn_texts):
+    # one document per policy: snippet + its synthetic questions + policy id
+    docs = [[pid, doc_store.text(i)] for i, pid in enumerate(doc_store.keys())]
+    rows = np.flatnonzero(doc_store.syn_policy_idx >= 0)
+    for r in rows.tolist():
+        docs[doc_store.syn_policy_idx[r]].append(syn_texts[r])
+    return BM25Index.build(docs)
@@ -1,7 +1,7 @@
 import os
 import json
 from pathlib import Path
-from .pipeline import classify_pdf, match_query
+from .pipeline import classify_pdf, match_query, get_default_engine
 
 def main():
     # locate the latest pdf (if any)
@@ -59,5 +59,10 @@ def main():
         print("Reason (snippet):", (r.get("reason") or "")[:300], "...")
         print("Decision:", r.get("decision"))
 
+    print("\nStartup report:", json.dumps(get_default_engine().startup_report(), indent=2))
+    print("Cache stats:", json.dumps(get_default_engine().cache_stats(), indent=2))
+    print("Counters:", json.dumps(get_default_engine().counters, indent=2))
+    print("Memory:", json.dumps(get_default_engine().memory_report(), indent=2))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+import re
+from pathlib import Path
+
+# Compiled matchers for the toxicity detector (PII scanning lives in pii.py).
+# Patterns are compiled once at import; term lexicons go through an
+# Aho-Corasick automaton, so a scan costs one pass over the text however many
+# terms there are.
+
+THREAT_PATTERN = re.compile(r'\b(kill|bomb|die|harm|destroy)\b', re.I)
+
+def load_terms(path):
+    # one term per line; blank lines and '#' comments are skipped
+    terms = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            terms.append(line)
+    return terms
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+class Lexicon:
+    # Aho-Corasick automaton over `terms`. Terms are stored as normalize(term)
+    # and matched against text that the caller has normalized the same way.
+    # Uses pyahocorasick when it is installed, a pure-Python automaton otherwise.
+    def __init__(self, terms, normalize=None):
+        self.terms = list(terms)
+        keys = {}
+        for i, term in enumerate(self.terms):
+            key = normalize(term) if normalize else term
+            if key:
+                keys.setdefault(key, []).append(i)
+        self.keys = keys
+        if ahocorasick is not None:
+            self._auto = ahocorasick.Automaton()
+            for key, ids in keys.items():
+                self._auto.add_word(key, (len(key), ids))
+            if keys:
+                self._auto.make_automaton()
+        else:
+            self._auto = None
+            self._build(keys)
+
+    @classmethod
+    def from_file(cls, path, normalize=None):
+        return cls(load_terms(path), normalize=normalize)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _build(self, keys):
+        goto, fail, out = [{}], [0], [[]]
+        for key, ids in keys.items():
+            s = 0
+            for ch in key:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                s = nxt
+            out[s].append((len(key), ids))
+        # breadth-first: fail links, and each state inherits its fail state's outputs
+        queue = list(goto[0].values())
+        for s in queue:
+            for ch, nxt in goto[s].items():
+                queue.append(nxt)
+                f = fail[s]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def _scan(self, text):
+        # yields (end_index, (key_len, term ids)) for every occurrence
+        if self._auto is not None:
+            if self.keys:
+                yield from self._auto.iter(text)
+            return
+        goto, fail, out = self._goto, self._fail, self._out
+        s = 0
+        for i, ch in enumerate(text):
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            for hit in out[s]:
+                yield i, hit
+
+    def find_all(self, text):
+        # [(start, end, term)] for every (possibly overlapping) occurrence
+        hits = [(end + 1 - n, end + 1, self.terms[i]) for end, (n, ids) in self._scan(text) for i in ids]
+        hits.sort(key=lambda h: (h[0], h[1]))
+        return hits
+
+    def found(self, text):
+        # terms occurring in text at least once, in lexicon order
+        ids = set()
+        for _, (_, term_ids) in self._scan(text):
+            ids.update(term_ids)
+        return [self.terms[i] for i in sorted(ids)]
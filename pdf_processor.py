@@ -1,17 +1,22 @@
-import io
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import zlib
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from .config import OCR_ZOOM, OCR_LANG, OCR_CONF_THRESHOLD
+from .config import (OCR_ZOOM_LADDER, OCR_DENOISE_SIGMA, OCR_LANG, OCR_CONF_THRESHOLD, PDF_WORKERS, PDF_PAGES_PER_TASK,
+                     OCR_CACHE_PATH, OCR_CACHE_MAX_BYTES, OCR_NOISE_MIN_PX)
+from .caches import SqliteCache
 
 try:
     import fitz  # PyMuPDF
 except Exception:
     fitz = None
 
-try:
-    from PIL import Image
-except Exception:
-    Image = None
-
 try:
     import pytesseract
 except Exception:
@@ -22,54 +27,237 @@ try:
 except Exception:
     cv2 = None
 
-def extract_text_from_pdf(pdf_path, zoom=OCR_ZOOM, ocr_lang=OCR_LANG, ocr_conf_threshold=OCR_CONF_THRESHOLD):
-    pages = []
+_NOISE_MASK = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+def _tick(timings, key, t0):
+    t1 = time.perf_counter()
+    timings[key] = timings.get(key, 0.0) + t1 - t0
+    return t1
+
+def _render_gray(page, matrix, clip=None):
+    # -> (pixmap, uint8 view of its samples); keep the pixmap alive while the
+    # view is in use, the view does not own the memory
+    pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+    buf = pix.samples_mv if hasattr(pix, "samples_mv") else pix.samples
+    gray = np.frombuffer(buf, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return pix, gray
+
+def noise_sigma(gray):
+    # Immerkaer's noise estimate (std of the noise, in grey levels). Uses the
+    # median of the filter response rather than the mean, so text edges on an
+    # otherwise clean page do not read as noise. None when the image is too
+    # small to say.
+    if min(gray.shape[:2]) < 3:
+        return None
+    r = cv2.filter2D(gray, cv2.CV_32F, _NOISE_MASK)[1:-1:2, 1:-1:2]
+    sigma = float(np.median(np.abs(r))) / (0.6745 * 6.0) if r.size else float("nan")
+    return sigma if np.isfinite(sigma) else None
+
+def _scan_noise_sigma(page):
+    # Noise of the page scan at its own pixel pitch: renders at other zooms
+    # resample the noise and hide it from the estimate, so this renders the
+    # central quarter of the image 1:1, aligned to its pixel grid. The scan is
+    # the largest image on the page whose central quarter has at least
+    # OCR_NOISE_MIN_PX pixels a side (logos and icons do not count). None
+    # when there is no such image.
+    infos = [i for i in page.get_image_info()
+             if i["bbox"][2] > i["bbox"][0] and i["bbox"][3] > i["bbox"][1]
+             and min(3 * i["width"] // 4 - i["width"] // 4, 3 * i["height"] // 4 - i["height"] // 4) >= OCR_NOISE_MIN_PX]
+    if not infos:
+        return None
+    info = max(infos, key=lambda i: (i["bbox"][2] - i["bbox"][0]) * (i["bbox"][3] - i["bbox"][1]))
+    x0, y0, x1, y1 = info["bbox"]
+    w, h = info["width"], info["height"]
+    sx, sy = w / (x1 - x0), h / (y1 - y0)
+    ex, ey = round(x0 * sx) - x0 * sx, round(y0 * sy) - y0 * sy
+    clip = fitz.Rect(x0 + (w // 4) / sx, y0 + (h // 4) / sy, x0 + (3 * w // 4) / sx, y0 + (3 * h // 4) / sy)
+    pix, gray = _render_gray(page, fitz.Matrix(sx, 0, 0, sy, ex, ey), clip)
+    return noise_sigma(gray)
+
+def _ocr_gray(gray, denoise, ocr_lang, ocr_conf_threshold, timings):
+    # -> (words kept, mean confidence over all recognized words)
+    t0 = time.perf_counter()
+    if denoise:
+        gray = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+        t0 = _tick(timings, "denoise_s", t0)
+    _, th = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    t0 = _tick(timings, "threshold_s", t0)
+
+    ocr_data = pytesseract.image_to_data(th, lang=ocr_lang, output_type=pytesseract.Output.DICT)
+    _tick(timings, "ocr_s", t0)
+    words = []
+    confs = []
+    n_boxes = len(ocr_data['text'])
+    for idx in range(n_boxes):
+        w = str(ocr_data['text'][idx]).strip()
+        try:
+            conf = float(ocr_data['conf'][idx])
+        except Exception:
+            conf = -1.0
+        if w and conf >= 0:
+            confs.append(conf)
+        if w and conf >= ocr_conf_threshold:
+            left = int(ocr_data['left'][idx])
+            top = int(ocr_data['top'][idx])
+            width = int(ocr_data['width'][idx])
+            height = int(ocr_data['height'][idx])
+            words.append({'word': w, 'left': left, 'top': top, 'width': width, 'height': height, 'conf': conf})
+    mean_conf = sum(confs) / len(confs) if confs else 0.0
+    return words, mean_conf
+
+def _ocr_page(page, zooms, ocr_lang, ocr_conf_threshold, timings):
+    # Renders at each zoom in turn until the mean word confidence reaches
+    # ocr_conf_threshold; keeps the most confident attempt. Box coordinates are
+    # in pixels at the zoom that was kept.
+    if cv2 is None or pytesseract is None:
+        raise RuntimeError("OCR libraries (cv2, pytesseract) not available. Cannot perform OCR fallback.")
+    t0 = time.perf_counter()
+    sigma = _scan_noise_sigma(page)
+    _tick(timings, "noise_s", t0)
+    best = None
+    for attempt, zoom in enumerate(zooms, 1):
+        t0 = time.perf_counter()
+        pix, gray = _render_gray(page, fitz.Matrix(zoom, zoom))
+        t0 = _tick(timings, "render_s", t0)
+        if sigma is None:
+            # no usable scan image: estimate on the render
+            sigma = noise_sigma(gray)
+            _tick(timings, "noise_s", t0)
+        denoise = sigma is not None and sigma > OCR_DENOISE_SIGMA
+        words, mean_conf = _ocr_gray(gray, denoise, ocr_lang, ocr_conf_threshold, timings)
+        del gray, pix
+        if best is None or mean_conf > best["ocr_mean_conf"]:
+            best = {"ocr_boxes": words, "ocr_zoom": zoom, "ocr_mean_conf": mean_conf, "noise_sigma": round(sigma, 2) if sigma is not None else None,
+                    "denoised": denoise}
+        if mean_conf >= ocr_conf_threshold:
+            break
+    best["ocr_attempts"] = attempt
+    return best
+
+@lru_cache(maxsize=1)
+def ocr_cache():
+    # one per process; SqliteCache opens its own connection after a fork
+    if OCR_CACHE_PATH is None:
+        return None
+    return SqliteCache(OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_BYTES)
+
+@lru_cache(maxsize=1)
+def _tesseract_version():
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return "unknown"
+
+def ocr_cache_key(page, zooms, ocr_lang, ocr_conf_threshold):
+    # What the page draws (content streams, image / form XObject dictionaries
+    # and raw streams, rotation and crop box) plus every setting that changes
+    # the OCR output. The dictionaries carry /Decode, /SMask and /ColorSpace,
+    # which change the rendered pixels without touching the stream; they name
+    # other objects by number, so the same scan re-uploaded in another file
+    # maps to the same key when its objects keep their numbers.
+    doc = page.parent
+    h = hashlib.blake2b(digest_size=16)
+    h.update(page.read_contents())
+    xrefs = sorted({x for img in page.get_images(full=True) for x in img[:2] if x > 0}
+                   | {xo[0] for xo in page.get_xobjects()})
+    for xref in xrefs:
+        h.update(doc.xref_object(xref, compressed=True).encode("utf-8"))
+        h.update(doc.xref_stream_raw(xref) or b"")
+    settings = [list(zooms), ocr_lang, ocr_conf_threshold, OCR_DENOISE_SIGMA, OCR_NOISE_MIN_PX, page.rotation,
+                list(page.cropbox), _tesseract_version()]
+    h.update(json.dumps(settings).encode("utf-8"))
+    return "ocr3|" + h.hexdigest()
+
+_OCR_FIELDS = ("text", "ocr_boxes", "ocr_zoom", "ocr_mean_conf", "ocr_attempts", "noise_sigma", "denoised")
+
+def _extract_page(doc, i, zoom, ocr_lang, ocr_conf_threshold):
+    timings = {}
+    t0 = time.perf_counter()
+    page = doc.load_page(i)
+    txt = page.get_text("text").strip()
+    _tick(timings, "text_s", t0)
+    page_info = {"page_num": i, "text": txt, "is_selectable": bool(txt), "ocr_boxes": None}
+    if not txt:
+        # OCR fallback, through the on-disk cache when OCR_CACHE_PATH is set
+        zooms = tuple(zoom) if isinstance(zoom, (tuple, list)) else (zoom,)
+        cache = ocr_cache()
+        hit = None
+        if cache is not None:
+            t0 = time.perf_counter()
+            key = ocr_cache_key(page, zooms, ocr_lang, ocr_conf_threshold)
+            hit = cache.get(key)
+            _tick(timings, "cache_s", t0)
+        if hit is not None:
+            page_info.update(json.loads(zlib.decompress(hit)))
+        else:
+            page_info.update(_ocr_page(page, zooms, ocr_lang, ocr_conf_threshold, timings))
+            page_info['text'] = " ".join(w['word'] for w in page_info['ocr_boxes']).strip()
+            if cache is not None:
+                cache.put(key, zlib.compress(json.dumps({f: page_info[f] for f in _OCR_FIELDS}).encode("utf-8")))
+                # few, large entries: keep the size cap on every write
+                cache.evict()
+        page_info['ocr_cached'] = hit is not None
+        page_info['is_selectable'] = False
+    timings["total_s"] = sum(timings.values())
+    page_info["timings"] = {k: round(v, 4) for k, v in timings.items()}
+    return page_info
+
+def _extract_range(pdf_path, start, stop, zoom, ocr_lang, ocr_conf_threshold):
+    # runs in a worker: each one opens its own handle on the file
+    doc = fitz.open(pdf_path)
+    try:
+        return [_extract_page(doc, i, zoom, ocr_lang, ocr_conf_threshold) for i in range(start, stop)]
+    finally:
+        doc.close()
+
+def _init_worker():
+    # one thread per process; the pool provides the parallelism
+    os.environ["OMP_THREAD_LIMIT"] = "1"  # inherited by the tesseract subprocess
+    if cv2 is not None:
+        cv2.setNumThreads(1)
+
+def _pool_context():
+    # never fork: the parent may hold model threads, locks and an open
+    # sqlite cache; forkserver children start from a clean interpreter
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def resolve_workers(workers=PDF_WORKERS):
+    return (os.cpu_count() or 1) if workers == 0 else max(1, workers)
+
+def iter_pages(pdf_path, zoom=OCR_ZOOM_LADDER, ocr_lang=OCR_LANG, ocr_conf_threshold=OCR_CONF_THRESHOLD,
+               workers=PDF_WORKERS):
+    # Pages one at a time, in page order. workers > 1 spreads page ranges of
+    # PDF_PAGES_PER_TASK over a process pool, with at most 2 * workers ranges
+    # in flight so a slow consumer does not pile up finished pages.
     if fitz is None:
         raise RuntimeError("PyMuPDF (fitz) is required for PDF extraction. Install pymupdf.")
     doc = fitz.open(pdf_path)
-    for i in range(len(doc)):
-        page = doc.load_page(i)
-        txt = page.get_text("text").strip()
-        page_info = {"page_num": i, "text": txt, "is_selectable": bool(txt), "ocr_boxes": None}
-        if not txt:
-            # OCR fallback
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            
-            if Image is None or cv2 is None or pytesseract is None:
-                raise RuntimeError("OCR libraries (PIL, cv2, pytesseract) not available. Cannot perform OCR fallback.")
-
-            img = Image.open(io.BytesIO(pix.tobytes()))
-            arr = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-            gray = cv2.cvtColor(arr, cv2.COLOR_BGR2GRAY)
-            gray = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-            _, th = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-            ocr_data = pytesseract.image_to_data(th, lang=ocr_lang, output_type=pytesseract.Output.DICT)
-            words = []
-            text_acc = []
-            n_boxes = len(ocr_data['text'])
-            for idx in range(n_boxes):
-                w = str(ocr_data['text'][idx]).strip()
-                conf_raw = ocr_data['conf'][idx]
-                try:
-                    conf = float(conf_raw)
-                except Exception:
-                    try:
-                        conf = float(conf_raw) if conf_raw else -1.0
-                    except Exception:
-                        conf = -1.0
-                if w and conf >= ocr_conf_threshold:
-                    left = int(ocr_data['left'][idx])
-                    top = int(ocr_data['top'][idx])
-                    width = int(ocr_data['width'][idx])
-                    height = int(ocr_data['height'][idx])
-                    words.append({'word': w, 'left': left, 'top': top, 'width': width, 'height': height, 'conf': conf})
-                    text_acc.append(w)
-            ocr_text = " ".join(text_acc).strip()
-            page_info['text'] = ocr_text
-            page_info['is_selectable'] = False
-            page_info['ocr_boxes'] = words
-        pages.append(page_info)
+    n = len(doc)
+    workers = min(resolve_workers(workers), -(-n // PDF_PAGES_PER_TASK))
+    if workers <= 1:
+        try:
+            for i in range(n):
+                yield _extract_page(doc, i, zoom, ocr_lang, ocr_conf_threshold)
+        finally:
+            doc.close()
+        return
     doc.close()
-    return pages
+    starts = iter(range(0, n, PDF_PAGES_PER_TASK))
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(), initializer=_init_worker)
+    try:
+        pending = deque()
+        for start in starts:
+            pending.append(pool.submit(_extract_range, pdf_path, start, min(start + PDF_PAGES_PER_TASK, n),
+                                       zoom, ocr_lang, ocr_conf_threshold))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # the caller may stop early
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def extract_text_from_pdf(pdf_path, zoom=OCR_ZOOM_LADDER, ocr_lang=OCR_LANG, ocr_conf_threshold=OCR_CONF_THRESHOLD,
+                          workers=PDF_WORKERS):
+    return list(iter_pages(pdf_path, zoom, ocr_lang, ocr_conf_threshold, workers))
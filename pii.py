@@ -0,0 +1,327 @@
+import argparse
+import multiprocessing as mp
+import random
+import re
+import time
+from .config import PII_STREAM_OVERLAP
+
+# Linear-time PII scanner. Each detector walks the text once with string scans
+# and simple tokens instead of backtracking regexes, and finds the same shapes
+# as the patterns it replaces (REGEX_PATTERNS, kept for the benchmark):
+#   email      [\w.-]+@[\w.-]+\.\w+
+#   phone      \b(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?){2,}\d{2,4}\b
+#   id_number  \b(?:ssn|nid|nic|passport)[\s:]*[A-Za-z0-9-]{3,}\b  (any case)
+#   name       \bmy name is ([A-Z][a-z]+)\b  (the span covers the name)
+PII_TYPES = ("email", "phone", "id_number", "name")
+
+REGEX_PATTERNS = {
+    "email": re.compile(r"[\w\.-]+@[\w\.-]+\.\w+"),
+    "phone": re.compile(r"\b(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?){2,}\d{2,4}\b"),
+    "id_number": re.compile(r"\b(?:ssn|nid|nic|passport)[\s:]*[A-Za-z0-9\-]{3,}\b", re.I),
+    "name": re.compile(r"\bmy name is ([A-Z][a-z]+)\b"),
+}
+
+_DIGITS = re.compile(r"\d+")
+_ID_KEY = re.compile(r"\b(?:ssn|nid|nic|passport)", re.I)
+_NAME_KEY = "my name is "
+
+def _is_word(c):
+    return c.isalnum() or c == "_"
+
+def _boundary(text, i):
+    # \b at position i
+    before = i > 0 and _is_word(text[i - 1])
+    after = i < len(text) and _is_word(text[i])
+    return before != after
+
+def _is_email_char(c):
+    return c == "." or c == "-" or _is_word(c)
+
+def _scan_email(text):
+    n, last = len(text), 0
+    at = text.find("@")
+    while at != -1:
+        lo = at
+        while lo > last and _is_email_char(text[lo - 1]):
+            lo -= 1
+        hi = at + 1
+        while hi < n and _is_email_char(text[hi]):
+            hi += 1
+        end = -1
+        if lo < at:
+            # rightmost '.' in the domain with a char before it and a word char after it
+            dot = text.rfind(".", at + 2, hi)
+            while dot != -1 and not (dot + 1 < hi and _is_word(text[dot + 1])):
+                dot = text.rfind(".", at + 2, dot)
+            if dot != -1:
+                end = dot + 1
+                while end < hi and _is_word(text[end]):
+                    end += 1
+        if end != -1:
+            yield "email", lo, end
+            last = end
+            at = text.find("@", end)
+        else:
+            at = text.find("@", at + 1)
+
+def _gap_ok(text, a, b):
+    # between two digit groups: optional ')', one of [-.\s], optional '('
+    if b - a > 3:
+        return False
+    i = a
+    if i < b and text[i] == ")":
+        i += 1
+    if i < b and (text[i] in "-." or text[i].isspace()):
+        i += 1
+    if i < b and text[i] == "(":
+        i += 1
+    return i == b
+
+def _phone_end(text, run, plus=False):
+    # End of the longest match over run, or None: at least 3 pieces of 2-4
+    # digits after the optional country code, a non-word char after the last
+    # group, and a last group right after '(' needs 4+ digits (the final
+    # \d{2,4} takes no '('). With plus, the match starts at '+' and the first
+    # group must hold the country code.
+    pieces, best = 0, None
+    for k, (a, b, gap) in enumerate(run):
+        n = b - a
+        if k == 0:
+            n = (n - 1 if n >= 3 else 0) if plus else (0 if n == 1 else n)
+        elif k == 1 and plus and gap.startswith(")") and run[0][1] - run[0][0] <= 2:
+            # a bare country code cannot be followed by ')'
+            break
+        pieces += n // 2
+        if pieces >= 3 and ("(" not in gap or b - a >= 4) and (b == len(text) or not _is_word(text[b])):
+            best = b
+    return best
+
+def _phone_in_run(text, run):
+    # run: digit groups (start, end, gap before) joined by valid gaps. The
+    # match starts at the first group with a \b before it, or one char earlier
+    # at a '(' / '+' that follows a word char.
+    if run and run[0][0] > 0 and _is_word(text[run[0][0] - 1]):
+        run = run[1:]
+    if not run:
+        return None
+    a0 = run[0][0]
+    lead = text[a0 - 1] if a0 >= 2 and _is_word(text[a0 - 2]) else ""
+    if lead == "+":
+        end = _phone_end(text, run, plus=True)
+        if end is not None:
+            return a0 - 1, end
+    end = _phone_end(text, run)
+    if end is None:
+        return None
+    if lead == "(" and run[0][1] - a0 >= 2:
+        return a0 - 1, end
+    return a0, end
+
+def _scan_phone(text):
+    run = []
+    for m in _DIGITS.finditer(text):
+        a, b = m.span()
+        # a single digit can only open a run, as a country code, which takes no ')'
+        if run and (b - a == 1 or not _gap_ok(text, run[-1][1], a)
+                    or (len(run) == 1 and run[0][1] - run[0][0] == 1 and text[run[0][1]] == ")")):
+            hit = _phone_in_run(text, run)
+            if hit:
+                yield ("phone",) + hit
+            run = []
+        run.append((a, b, text[run[-1][1]:a] if run else ""))
+    hit = _phone_in_run(text, run)
+    if hit:
+        yield ("phone",) + hit
+
+def _scan_id_number(text):
+    n, pos = len(text), 0
+    while True:
+        m = _ID_KEY.search(text, pos)
+        if m is None:
+            return
+        i = m.end()
+        while i < n and (text[i].isspace() or text[i] == ":"):
+            i += 1
+        j = i
+        while j < n and (text[j] == "-" or (text[j].isascii() and text[j].isalnum())):
+            j += 1
+        while j - i >= 3 and not _boundary(text, j):
+            j -= 1
+        if j - i >= 3:
+            yield "id_number", m.start(), j
+            pos = j
+        else:
+            pos = m.start() + 1
+
+def _scan_name(text):
+    n, pos = len(text), 0
+    while True:
+        i = text.find(_NAME_KEY, pos)
+        if i == -1:
+            return
+        pos = i + 1
+        if i > 0 and _is_word(text[i - 1]):
+            continue
+        j = i + len(_NAME_KEY)
+        if j < n and "A" <= text[j] <= "Z":
+            k = j + 1
+            while k < n and "a" <= text[k] <= "z":
+                k += 1
+            if k > j + 1 and not (k < n and _is_word(text[k])):
+                yield "name", j, k
+                pos = k
+
+_SCANNERS = {"email": _scan_email, "phone": _scan_phone, "id_number": _scan_id_number, "name": _scan_name}
+
+def scan_pii(text, types=PII_TYPES):
+    # [{"type", "start", "end", "text"}] in text order
+    if not text:
+        return []
+    hits = [(a, b, kind) for t in types for kind, a, b in _SCANNERS[t](text)]
+    hits.sort()
+    return [{"type": kind, "start": a, "end": b, "text": text[a:b]} for a, b, kind in hits]
+
+def iter_pii(chunks, overlap=PII_STREAM_OVERLAP, types=PII_TYPES):
+    # Spans over a text delivered in pieces (e.g. pages), with offsets into
+    # their concatenation. Only a window of ~2 * overlap chars plus the newest
+    # chunk is held; spans up to `overlap` chars long come out exactly as
+    # scan_pii("".join(chunks)) would return them.
+    buf, base, done = "", 0, 0
+    for chunk in chunks:
+        buf += chunk
+        cut = len(buf) - overlap
+        if cut <= overlap:
+            continue
+        keep = cut
+        for sp in scan_pii(buf, types):
+            if base + sp["end"] <= done:
+                continue
+            if sp["end"] <= cut:
+                yield dict(sp, start=sp["start"] + base, end=sp["end"] + base)
+            else:
+                keep = min(keep, sp["start"])
+        done = base + cut
+        # keep some left context for the boundary checks
+        keep = max(0, keep - overlap)
+        buf, base = buf[keep:], base + keep
+    for sp in scan_pii(buf, types):
+        if base + sp["end"] > done:
+            yield dict(sp, start=sp["start"] + base, end=sp["end"] + base)
+
+def seam_pii(left, right, sep="\n\n", overlap=PII_STREAM_OVERLAP, types=PII_TYPES):
+    # spans of left + sep + right that cross sep, i.e. the ones a scan of each
+    # part on its own misses; only `overlap` chars either side are looked at
+    left, right = left[-overlap:], right[:overlap]
+    cut = len(left)
+    return [sp for sp in scan_pii(left + sep + right, types) if sp["start"] < cut + len(sep) and sp["end"] > cut]
+
+def pathological_inputs(n):
+    # inputs that make REGEX_PATTERNS backtrack, roughly n chars each
+    return {
+        "digit_run": "1" * n + "x",
+        "digit_groups": "12 " * (n // 3) + "12x",
+        "word_run": "a" * n,
+        "spaced_id": "ssn" + " " * n + "ab",
+    }
+
+def _time_regexes(text, out):
+    t0 = time.perf_counter()
+    for pat in REGEX_PATTERNS.values():
+        pat.search(text)
+    out.put(time.perf_counter() - t0)
+
+def _regex_seconds(text, timeout_s):
+    # the old patterns can backtrack for longer than anyone will wait, so they
+    # run in a child process that is killed after timeout_s (None)
+    out = mp.Queue()
+    proc = mp.Process(target=_time_regexes, args=(text, out), daemon=True)
+    proc.start()
+    proc.join(timeout_s)
+    if proc.is_alive():
+        proc.kill()
+        proc.join()
+        return None
+    return out.get()
+
+def benchmark(sizes=(16, 24, 32, 40, 1000, 10000, 100000), regex_timeout_s=2.0):
+    # yields seconds per input for the scanner and the old regexes; once a regex
+    # input times out it is not retried at larger sizes
+    slow = set()
+    for n in sizes:
+        for name, text in pathological_inputs(n).items():
+            t0 = time.perf_counter()
+            scan_pii(text)
+            scan_s = time.perf_counter() - t0
+            regex_s = None
+            if name not in slow:
+                regex_s = _regex_seconds(text, regex_timeout_s)
+                if regex_s is None:
+                    slow.add(name)
+            yield {"input": name, "chars": len(text), "scanner_s": scan_s, "regex_s": regex_s}
+
+# fragments that random test texts are glued from: digits, separators, keys
+# and near-misses of every pattern
+_CHECK_ALPHABETS = (
+    ["1", "2", "3", "45", "678", "9012", " ", "-", ".", "(", ")", "+", "\n", "a", "X", "_", "@", "b.c", "ssn", "SSN",
+     "nic", ":", "my name is ", "Jo", "hn", "\u00e9", "x@y.com", "  ", "+1", "(800) ", "555-1234"],
+    ["1", "22", "333", "4444", "55555", " ", "-", ".", "(", ")", "+", "x", "_", "\u0663\u0664", "\t"],
+)
+
+def _random_text(rng, lo, hi):
+    alphabet = rng.choice(_CHECK_ALPHABETS)
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi)))
+
+def differential_check(n=20000, seed=0):
+    # scan_pii vs. REGEX_PATTERNS on n random texts -> [(type, text, regex spans, scanner spans)]
+    rng = random.Random(seed)
+    bad = []
+    for _ in range(n):
+        text = _random_text(rng, 1, 14)
+        got = scan_pii(text)
+        for kind, pat in REGEX_PATTERNS.items():
+            ref = [m.span(1) if kind == "name" else m.span() for m in pat.finditer(text)]
+            mine = [(sp["start"], sp["end"]) for sp in got if sp["type"] == kind]
+            if ref != mine:
+                bad.append((kind, text, ref, mine))
+    return bad
+
+def streaming_check(n=2000, overlap=32, seed=0):
+    # iter_pii over random chunkings vs. scan_pii of the joined text, for spans
+    # up to `overlap` chars -> [(chunks, expected, streamed)]
+    rng = random.Random(seed)
+    bad = []
+    for _ in range(n):
+        text = _random_text(rng, 20, 200)
+        cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 12)))
+        chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        key = lambda sp: (sp["type"], sp["start"], sp["end"])
+        ref = sorted(key(sp) for sp in scan_pii(text) if sp["end"] - sp["start"] <= overlap)
+        got = sorted(key(sp) for sp in iter_pii(chunks, overlap) if sp["end"] - sp["start"] <= overlap)
+        if ref != got:
+            bad.append((chunks, ref, got))
+    return bad
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the PII scanner against the old regexes on pathological input.")
+    ap.add_argument("--sizes", nargs="+", type=int, default=[16, 24, 32, 40, 1000, 10000, 100000])
+    ap.add_argument("--regex-timeout", type=float, default=2.0, help="give up on a regex input after this many seconds")
+    ap.add_argument("--check", action="store_true",
+                    help="instead: compare the scanner with REGEX_PATTERNS and iter_pii with scan_pii on random texts")
+    ap.add_argument("--n", type=int, default=20000, help="--check: random texts per comparison")
+    args = ap.parse_args(argv)
+    if args.check:
+        diff, stream = differential_check(args.n), streaming_check(max(1, args.n // 10))
+        print(f"scanner vs. regexes: {len(diff)} mismatches in {args.n} texts")
+        for kind, text, ref, mine in diff[:10]:
+            print(f"  {kind}: {text!r} regex {ref} scanner {mine}")
+        print(f"iter_pii vs. scan_pii: {len(stream)} mismatches in {max(1, args.n // 10)} texts")
+        for chunks, ref, got in stream[:10]:
+            print(f"  {chunks!r}: expected {ref} streamed {got}")
+        raise SystemExit(1 if diff or stream else 0)
+    print(f"{'input':<14} {'chars':>8} {'scanner s':>10} {'regex s':>10}")
+    for r in benchmark(args.sizes, args.regex_timeout):
+        regex = f"{r['regex_s']:.4f}" if r["regex_s"] is not None else ">timeout"
+        print(f"{r['input']:<14} {r['chars']:>8} {r['scanner_s']:>10.4f} {regex:>10}")
+
+if __name__ == "__main__":
+    main()
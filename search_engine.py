@@ -1,162 +1,282 @@
 import numpy as np
 from scipy.special import expit
-from sentence_transformers import SentenceTransformer
-from sentence_transformers.cross_encoder import CrossEncoder
-from .config import RETRIEVER_MODEL, RERANKER_MODEL, EMBED_CACHE_DIR, TOP_K, QUERY_TOP_K, RERANK_TOP
-from .data_manager import syn, doc_store
-
-print("Initializing search engine...")
-embedder = SentenceTransformer(RETRIEVER_MODEL)
-
-# Synthetic queries embeddings
-syn_cache = EMBED_CACHE_DIR / "syn_emb.npy"
-syn_texts = syn["simple_question"].astype(str).tolist() if not syn.empty else []
-
-if syn_cache.exists() and len(syn_texts) > 0:
-    try:
-        syn_emb = np.load(syn_cache)
-        if syn_emb.shape[0] != len(syn_texts):
-            print("Cached synthetic embeddings size mismatch. Recomputing...")
-            raise ValueError("Size mismatch")
-        print("Loaded synthetic embeddings from cache.")
-    except Exception:
-        print("Encoding synthetic queries...")
-        syn_emb = embedder.encode(syn_texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=True)
-        np.save(syn_cache, syn_emb)
-else:
-    if syn_texts:
-        print("Encoding synthetic queries...")
-        syn_emb = embedder.encode(syn_texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=True)
-        np.save(syn_cache, syn_emb)
-    else:
-        syn_emb = np.array([])
-
-# Index (FAISS or Sklearn)
-USE_FAISS = False
-faiss_index = None
-nn = None
-
-if len(syn_emb) > 0:
-    try:
-        import faiss
-        USE_FAISS = True
-        dim = syn_emb.shape[1]
-        faiss_index = faiss.IndexFlatIP(dim)
-        faiss_index.add(syn_emb.astype(np.float32))
-        print("Built FAISS index for synthetic queries.")
-    except Exception:
-        from sklearn.neighbors import NearestNeighbors
-        nn = NearestNeighbors(n_neighbors=min(max(QUERY_TOP_K, TOP_K), len(syn_emb)), metric="cosine").fit(syn_emb)
-        print("FAISS not available or failed — using sklearn NearestNeighbors for retrieval.")
-else:
-    print("Warning: No synthetic queries to index.")
-
-# Reranker
-reranker = CrossEncoder(RERANKER_MODEL)
-print("Loaded cross-encoder reranker.")
-
-# Chunk embeddings
-chunk_ids = list(doc_store.keys())
-chunk_texts = [doc_store[cid]["snippet_text"] for cid in chunk_ids]
-chunk_emb_cache = EMBED_CACHE_DIR / "chunk_emb.npy"
-
-if chunk_emb_cache.exists() and len(chunk_texts) > 0:
-    try:
-        chunk_embs = np.load(chunk_emb_cache)
-        if chunk_embs.shape[0] != len(chunk_texts):
-             raise ValueError("Size mismatch")
-        print("Loaded chunk embeddings from cache.")
-    except Exception:
-        print("Encoding chunk embeddings for similarity signals...")
-        chunk_embs = embedder.encode(chunk_texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=True)
-        np.save(chunk_emb_cache, chunk_embs)
-else:
-    if chunk_texts:
-        print("Encoding chunk embeddings for similarity signals...")
-        chunk_embs = embedder.encode(chunk_texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=True)
-        np.save(chunk_emb_cache, chunk_embs)
-    else:
-        chunk_embs = np.array([])
+from .config import (RETRIEVER_MODEL, RERANKER_MODEL, RETRIEVER_REVISION, RERANKER_REVISION,
+                     TOP_K, RERANK_TOP, ENCODE_BATCH_SIZE, INDEX_TYPE,
+                     RETRIEVAL_MODE, POLICY_TOP_N, RERANK_ALPHA, RERANK_MODE, CASCADE_BATCH,
+                     SIM_THRESHOLD, RISK_LEVEL_THRESHOLDS, SPARSE_MODE, SPARSE_TOP_N)
+from .embed_cache import encode_cached
+from .caches import text_key
+from .vector_index import open_vector_index
+from .backends import load_sentence_transformer, load_cross_encoder, model_tag
+from .lexical import rrf_fuse
+from .cascade import prob_upper_bound
+
+def _resolve_engine(engine):
+    if engine is not None:
+        return engine
+    from .engine import get_default_engine
+    return get_default_engine()
+
+def load_embedder():
+    print("Initializing search engine...")
+    return load_sentence_transformer()
+
+def load_reranker():
+    reranker = load_cross_encoder()
+    print("Loaded cross-encoder reranker.")
+    return reranker
 
-chunkid_to_idx = {cid: i for i, cid in enumerate(chunk_ids)}
+def retriever_cache_name():
+    # embeddings from different backends / quantization are cached separately
+    return RETRIEVER_MODEL + model_tag("retriever")
 
-def retrieve_candidate_chunk_ids(query, top_k=TOP_K):
+def load_syn_embeddings(embedder, syn):
+    # Synthetic queries embeddings
+    syn_texts = syn["simple_question"].astype(str).tolist() if not syn.empty else []
+    return encode_cached(embedder, syn_texts, "syn", retriever_cache_name(), RETRIEVER_REVISION)
+
+def build_vector_index(syn_emb):
+    # VectorIndex over the synthetic queries (FAISS or exact NumPy), or None
     if len(syn_emb) == 0:
+        print("Warning: No synthetic queries to index.")
+        return None
+    return open_vector_index(syn_emb, INDEX_TYPE)
+
+def load_chunk_embeddings(embedder, doc_store):
+    # Chunk embeddings for similarity signals
+    return encode_cached(embedder, doc_store.texts(), "chunks", retriever_cache_name(), RETRIEVER_REVISION)
+
+def encode_texts(embedder, texts, batch_size=ENCODE_BATCH_SIZE):
+    emb = embedder.encode(list(texts), batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+    return np.asarray(emb, dtype=np.float32).reshape(len(texts), -1)
+
+def predict_pairs(reranker, pairs):
+    logits = reranker.predict(list(pairs), show_progress_bar=False)
+    return np.asarray(logits, dtype=np.float32).reshape(len(pairs))
+
+def retriever_model_id():
+    name = retriever_cache_name()
+    return f"{name}@{RETRIEVER_REVISION}" if RETRIEVER_REVISION else name
+
+def embed_queries(queries, batch_size=ENCODE_BATCH_SIZE, engine=None):
+    # Normalized query embeddings, served from the engine's LRU where possible;
+    # all misses go to the embedder in a single encode call.
+    engine = _resolve_engine(engine)
+    cache = engine.query_emb_cache
+    model_id = retriever_model_id()
+    keys = [(model_id, text_key(q)) for q in queries]
+    vecs = [cache.get(k) for k in keys]
+    missing = {}
+    for i, v in enumerate(vecs):
+        if v is None:
+            missing.setdefault(keys[i], []).append(i)
+    if missing:
+        texts = [queries[rows[0]] for rows in missing.values()]
+        fresh = engine.encode_queries(texts, batch_size=batch_size)
+        for (key, rows), v in zip(missing.items(), fresh):
+            cache.put(key, v)
+            for i in rows:
+                vecs[i] = v
+    return np.stack(vecs)
+
+def _policies_for_rows(doc_store, rows):
+    rows = np.asarray(rows, dtype=np.int64)
+    policy_idx = doc_store.syn_policy_idx[rows[rows >= 0]]
+    policy_idx = policy_idx[policy_idx >= 0]
+    # unique policies, in rank order
+    _, first = np.unique(policy_idx, return_index=True)
+    return doc_store.policy_ids[policy_idx[np.sort(first)]].tolist()
+
+def retrieve_top_policies_batch(queries, top_n=POLICY_TOP_N, batch_size=ENCODE_BATCH_SIZE, engine=None):
+    # Scores every synthetic row, keeps the best row score per policy (max
+    # pooling) and returns the top_n policies per query, best first.
+    queries = [str(q) for q in queries]
+    if not queries:
         return []
-    
-    q_emb = embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)
-    if USE_FAISS and faiss_index:
-        D, I = faiss_index.search(q_emb.astype(np.float32), top_k)
-        indices = I[0].tolist()
-    elif nn:
-        n_neigh = min(top_k, len(syn_emb))
-        dists, indices = nn.kneighbors(q_emb.reshape(1, -1), n_neighbors=n_neigh)
-        indices = indices[0].tolist()
-    else:
+    engine = _resolve_engine(engine)
+    syn_emb, doc_store = engine.syn_emb, engine.doc_store
+    row_order, starts, group_policy = doc_store.policy_groups()
+    if len(syn_emb) == 0 or len(starts) == 0:
+        return [[] for _ in queries]
+
+    q_emb = embed_queries(queries, batch_size=batch_size, engine=engine)
+    n = min(top_n, len(starts))
+    out = []
+    for lo in range(0, len(queries), batch_size):
+        scores = syn_emb.dot(q_emb[lo:lo + batch_size])
+        pooled = np.maximum.reduceat(scores[:, row_order], starts, axis=1)
+        top = np.argpartition(-pooled, n - 1, axis=1)[:, :n]
+        for p, t in zip(pooled, top):
+            t = t[np.argsort(-p[t], kind="stable")]
+            out.append(doc_store.policy_ids[group_policy[t]].tolist())
+    return out
+
+def _retrieve_rows_batch(queries, top_k, batch_size, engine):
+    syn_emb = engine.syn_emb
+    if len(syn_emb) == 0:
+        return [[] for _ in queries]
+
+    index = engine.index
+    if index is None:
+        return [[] for _ in queries]
+    q_emb = embed_queries(queries, batch_size=batch_size, engine=engine)
+    _, I = index.search(q_emb, top_k)
+
+    doc_store = engine.doc_store
+    return [_policies_for_rows(doc_store, rows) for rows in I]
+
+def sparse_candidates_batch(queries, top_n=SPARSE_TOP_N, engine=None):
+    # BM25 over policies; never touches the embedder
+    engine = _resolve_engine(engine)
+    bm25, policy_ids = engine.bm25, engine.doc_store.policy_ids
+    return [policy_ids[bm25.search(str(q), top_n)[0]].tolist() for q in queries]
+
+def retrieve_candidate_chunk_ids_batch(queries, top_k=TOP_K, batch_size=ENCODE_BATCH_SIZE, engine=None):
+    # One encode call and one index search for all queries; returns one list of
+    # unique policy ids per query, in input order.
+    queries = [str(q) for q in queries]
+    if not queries:
         return []
-        
-    policy_ids = syn.iloc[indices]["policy_id"].astype(str).tolist()
-    seen = set(); uniq = []
-    for pid in policy_ids:
-        if pid not in seen:
-            seen.add(pid); uniq.append(pid)
-    return uniq
-
-def rerank_chunks_with_probs(query, chunk_ids_to_rank, top_n=RERANK_TOP):
+    engine = _resolve_engine(engine)
+    if SPARSE_MODE == "sparse":
+        return sparse_candidates_batch(queries, engine=engine)
+    if RETRIEVAL_MODE == "grouped":
+        dense = retrieve_top_policies_batch(queries, batch_size=batch_size, engine=engine)
+    else:
+        dense = _retrieve_rows_batch(queries, top_k, batch_size, engine)
+    if SPARSE_MODE == "hybrid":
+        sparse = sparse_candidates_batch(queries, engine=engine)
+        return [rrf_fuse([d, sp]) for d, sp in zip(dense, sparse)]
+    return dense
+
+def retrieve_candidate_chunk_ids(query, top_k=TOP_K, engine=None):
+    return retrieve_candidate_chunk_ids_batch([query], top_k=top_k, engine=engine)[0]
+
+def reranker_model_id():
+    name = RERANKER_MODEL + model_tag("reranker")
+    return f"{name}@{RERANKER_REVISION}" if RERANKER_REVISION else name
+
+def rerank_logits(query, idx, pairs, engine=None):
+    # Cross-encoder logits for pairs[j] = [query, text of chunk idx[j]]. Scores
+    # are cached per (reranker model, query hash, policy id, snippet hash) in
+    # memory and, if RERANK_CACHE_PATH is set, on disk; only misses are scored.
+    engine = _resolve_engine(engine)
+    doc_store = engine.doc_store
+    prefix = f"{reranker_model_id()}|{text_key(query).hex()}|"
+    keys = [prefix + f"{doc_store.policy_ids[i]}|{doc_store.text_digest(i)}" for i in idx]
+    logits = np.empty(len(keys), dtype=np.float32)
+
+    mem, disk = engine.rerank_cache, engine.rerank_disk_cache
+    todo = []
+    for j, k in enumerate(keys):
+        v = mem.get(k)
+        if v is None:
+            todo.append(j)
+        else:
+            logits[j] = v
+    if todo and disk is not None:
+        found = disk.get_many(keys[j] for j in todo)
+        rest = []
+        for j in todo:
+            v = found.get(keys[j])
+            if v is None:
+                rest.append(j)
+            else:
+                logits[j] = np.frombuffer(v, dtype=np.float32)[0]
+                mem.put(keys[j], logits[j])
+        todo = rest
+    if todo:
+        fresh = engine.predict_pairs([pairs[j] for j in todo])
+        logits[todo] = fresh
+        for j, v in zip(todo, fresh):
+            mem.put(keys[j], v)
+        if disk is not None:
+            disk.put_many((keys[j], v.tobytes()) for j, v in zip(todo, fresh))
+    return logits
+
+# below this no combined score changes a decision (see match_query / classify_pdf)
+CASCADE_FLOOR = min(SIM_THRESHOLD, *RISK_LEVEL_THRESHOLDS.values())
+
+def _cascade_scores(cos_raw, cos_sims, score):
+    # Cross-encodes (via score(positions)) in order of the upper bound on the
+    # combined score until the best exact score beats every remaining bound:
+    # then the top result, and so its side of every threshold, is the one full
+    # reranking gives (with a valid bound). The rest keep their cosine-only
+    # lower bound. Nothing is cross-encoded when no bound reaches
+    # CASCADE_FLOOR: whichever candidate ranks first, it decides nothing.
+    # -> (path, positions scored)
+    alpha = RERANK_ALPHA
+    upper = alpha * prob_upper_bound(cos_raw) + (1.0 - alpha) * cos_sims
+    if upper.max() < CASCADE_FLOOR:
+        return "skipped", np.array([], dtype=np.int64)
+    order = np.argsort(-upper, kind="stable")
+    best, n = -np.inf, 0
+    while n < len(order) and upper[order[n]] >= best:
+        pos = order[n:n + CASCADE_BATCH]
+        best = max(best, float(np.max(alpha * score(pos) + (1.0 - alpha) * cos_sims[pos])))
+        n += len(pos)
+    return ("full" if n == len(order) else "partial"), np.sort(order[:n])
+
+def rerank_chunks_with_probs(query, chunk_ids_to_rank, top_n=RERANK_TOP, engine=None, mode=None):
+    # mode overrides RERANK_MODE. With SPARSE_MODE="sparse" no dense model is
+    # loaded: all candidates are cross-encoded and the combined score is the
+    # probability.
     if not chunk_ids_to_rank:
         return []
+    engine = _resolve_engine(engine)
+    doc_store = engine.doc_store
 
-    pairs = []
-    valid_ids = []
-    for pid in chunk_ids_to_rank:
-        info = doc_store.get(pid)
-        if info:
-            pairs.append([query, info["snippet_text"]])
-            valid_ids.append(pid)
-
-    if not pairs:
+    idx = doc_store.indices(chunk_ids_to_rank)
+    idx = idx[idx >= 0]
+    if len(idx) == 0:
         return []
+    pairs = [[query, t] for t in doc_store.texts(idx)]
 
-    logits = reranker.predict(pairs, show_progress_bar=False)
-    logits = np.array(logits).squeeze()
-    if logits.ndim > 1:
-        logits = logits.reshape(-1)
-
-    reranker_probs = expit(logits)
-    
-    # Handle single item case (scalar)
-    if reranker_probs.ndim == 0:
-        reranker_probs = np.array([reranker_probs])
-        logits = np.array([logits])
-
-    q_emb = embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)
-    q_vec = q_emb[0] if hasattr(q_emb, 'shape') and len(q_emb.shape) > 1 else q_emb
-
-    cos_sims = []
-    for pid in valid_ids:
-        idx = chunkid_to_idx.get(pid)
-        if idx is None:
-            cos_sims.append(0.0)
-        else:
-            cos = float(np.dot(q_vec, chunk_embs[idx]))
-            cos_scaled = (cos + 1.0) / 2.0
-            cos_sims.append(cos_scaled)
+    dense = SPARSE_MODE != "sparse"
+    if dense:
+        q_vec = embed_queries([query], engine=engine)[0]
+        cos_raw = engine.chunk_embs[idx] @ q_vec  # upcasts only the candidate rows
+        cos_sims = (cos_raw + 1.0) / 2.0
+    else:
+        cos_sims = np.full(len(idx), np.nan, dtype=np.float32)
+
+    # candidates the cascade did not cross-encode keep prob 0, i.e. their
+    # cosine-only lower bound
+    logits = np.full(len(idx), np.nan, dtype=np.float32)
+    reranker_probs = np.zeros(len(idx), dtype=np.float32)
+
+    def score(pos):
+        logits[pos] = rerank_logits(query, idx[pos], [pairs[j] for j in pos], engine=engine)
+        reranker_probs[pos] = expit(logits[pos])
+        return reranker_probs[pos]
+
+    mode = (mode or RERANK_MODE) if dense else "full"
+    if mode == "cascade":
+        path, to_score = _cascade_scores(cos_raw, cos_sims, score)
+    else:
+        path, to_score = "full", np.arange(len(idx))
+        score(to_score)
+    engine.count(f"rerank_path_{path}")
+    engine.count("rerank_pairs_scored", len(to_score))
+    engine.count("rerank_pairs_skipped", len(idx) - len(to_score))
 
-    alpha = 0.75
-    combined_scores = alpha * reranker_probs + (1.0 - alpha) * np.array(cos_sims)
+    alpha = RERANK_ALPHA
+    combined_scores = alpha * reranker_probs + (1.0 - alpha) * cos_sims if dense else reranker_probs
 
+    scored = np.zeros(len(idx), dtype=bool)
+    scored[to_score] = True
     results = []
-    for i, (pid, prob, cosv, comb) in enumerate(zip(valid_ids, reranker_probs, cos_sims, combined_scores)):
-        info = doc_store[pid]
+    for i, (row, prob, cosv, comb) in enumerate(zip(idx, reranker_probs, cos_sims, combined_scores)):
         results.append({
-            "policy_id": pid,
-            "base_id": info.get("base_id"),
-            "risk_category": info.get("risk_category"),
-            "snippet_text": info.get("snippet_text"),
-            "reranker_logit": float(logits[i]) if i < len(logits) else 0.0,
-            "reranker_prob": float(prob) if i < len(reranker_probs) else 0.0,
-            "cos_sim": float(cosv),
-            "combined_score": float(comb)
+            "policy_id": str(doc_store.policy_ids[row]),
+            "base_id": doc_store.base_id(row),
+            "risk_category": doc_store.risk_category(row),
+            "snippet_text": pairs[i][1],
+            "reranker_logit": float(logits[i]) if scored[i] else None,
+            "reranker_prob": float(prob) if scored[i] else None,
+            "cos_sim": float(cosv) if dense else None,
+            "combined_score": float(comb),
+            "rerank_path": path
         })
 
     results.sort(key=lambda x: x["combined_score"], reverse=True)
@@ -1,66 +1,205 @@
-from transformers import pipeline
 import re
 import unicodedata
+from functools import lru_cache
+from .config import (TOXICITY_MODEL, TOXICITY_BATCH_SIZE, TOXICITY_MAX_TOKENS, TOXICITY_WINDOW_OVERLAP,
+                     TOXIC_LEXICON_PATH, TOXICITY_GATING, TOXICITY_GATE_MIN_CHARS)
+from .matcher import Lexicon, THREAT_PATTERN
+from .caches import text_key
+from .backends import load_toxicity_pipeline, model_tag
 
-print("Loading toxicity classifier (may take a moment)...")
-try:
-    # some HF versions: top_k=None returns list/dicts correctly
-    toxicity_clf = pipeline("text-classification", model="unitary/toxic-bert", top_k=None)
-except Exception as e:
-    print(f"Warning: Could not load toxicity model. Error: {e}")
-    toxicity_clf = None
+def load_toxicity_clf():
+    print("Loading toxicity classifier (may take a moment)...")
+    try:
+        return load_toxicity_pipeline()
+    except Exception as e:
+        print(f"Warning: Could not load toxicity model. Error: {e}")
+        return None
+
+def run_toxicity(clf, texts, batch_size=TOXICITY_BATCH_SIZE):
+    # one list of {label, score} dicts per input text
+    if clf is None:
+        return [[] for _ in texts]
+    return clf(list(texts), batch_size=batch_size, truncation=True)
+
+TOXIC_LABELS = ['toxic','severe_toxicity','threat','insult','identity_hate','obscene']
+
+def parse_labels(out):
+    # {label: score} from any of the HF pipeline output shapes
+    if out and isinstance(out, list) and isinstance(out[0], list):
+        out = out[0]
+    per_label = {}
+    for d in out or []:
+        if isinstance(d, dict) and 'label' in d:
+            per_label[d['label'].lower()] = float(d.get('score', 0.0))
+    return per_label
+
+def _token_offsets(tokenizer, texts):
+    # (start, end) character offsets of each text's tokens; whitespace tokens
+    # if the classifier has no fast tokenizer
+    if texts and getattr(tokenizer, "is_fast", False):
+        return tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    return [[m.span() for m in re.finditer(r'\S+', t)] for t in texts]
+
+def token_windows(text, offsets, max_tokens=TOXICITY_MAX_TOKENS, overlap=TOXICITY_WINDOW_OVERLAP):
+    # [(window text, n_tokens)]: the text itself if it fits, else overlapping
+    # windows of max_tokens tokens
+    if len(offsets) <= max_tokens:
+        return [(text, len(offsets))]
+    out = []
+    for lo in range(0, len(offsets), max_tokens - overlap):
+        hi = min(lo + max_tokens, len(offsets))
+        out.append((text[offsets[lo][0]:offsets[hi - 1][1]], hi - lo))
+        if hi == len(offsets):
+            break
+    return out
+
+def toxicity_model_id():
+    return TOXICITY_MODEL + model_tag("toxicity")
+
+def gate_sentence(s, lex_hits, mode=TOXICITY_GATING):
+    # True if the model can be skipped for sentence s
+    if mode == "off":
+        return False
+    if len(s) < TOXICITY_GATE_MIN_CHARS or not any(c.isalpha() for c in s):
+        return True
+    return mode == "lexical" and not lex_hits and not THREAT_PATTERN.search(s)
+
+def classify_sentences(sentences, engine, batch_size=TOXICITY_BATCH_SIZE, skip=None):
+    # {label: score} per sentence; {} where skip[i] is set. Results are
+    # memoized in engine.toxicity_cache by whitespace-normalized sentence, and
+    # repeats within the call are scored once.
+    cache, model_id = engine.toxicity_cache, toxicity_model_id()
+    per_sentence = [{} for _ in sentences]
+    todo = {}
+    gated = hits = 0
+    for i, s in enumerate(sentences):
+        if skip is not None and skip[i]:
+            gated += 1
+            continue
+        key = (model_id, text_key(" ".join(s.split())))
+        cached = cache.get(key)
+        if cached is not None:
+            hits += 1
+            per_sentence[i] = dict(cached)
+        else:
+            todo.setdefault(key, []).append(i)
+    engine.count("toxicity_sentences", len(sentences))
+    engine.count("toxicity_gated", gated)
+    engine.count("toxicity_cache_hits", hits)
+    engine.count("toxicity_repeats", sum(len(rows) - 1 for rows in todo.values()))
+    engine.count("toxicity_model_sentences", len(todo))
+    if todo:
+        keys = list(todo)
+        for key, per_label in zip(keys, _classify_uncached([sentences[todo[k][0]] for k in keys], engine, batch_size)):
+            # failures ({}) are not cached
+            if per_label:
+                cache.put(key, per_label)
+            for i in todo[key]:
+                per_sentence[i] = dict(per_label)
+    return per_sentence
+
+def _classify_uncached(sentences, engine, batch_size):
+    # All windows of all sentences are sorted by token length and sent in
+    # batches, so each batch pads to similar lengths.
+    tokenizer = getattr(engine.toxicity_clf, "tokenizer", None)
+    windows, owner, lengths = [], [], []
+    for i, (s, offsets) in enumerate(zip(sentences, _token_offsets(tokenizer, sentences))):
+        for w, n in token_windows(s, offsets):
+            windows.append(w)
+            owner.append(i)
+            lengths.append(n)
+    engine.count("toxicity_model_windows", len(windows))
+    order = sorted(range(len(windows)), key=lengths.__getitem__)
+    parsed = [None] * len(windows)
+    for lo in range(0, len(order), batch_size):
+        batch = order[lo:lo + batch_size]
+        texts = [windows[j] for j in batch]
+        try:
+            outs = engine.classify_toxicity(texts)
+        except Exception:
+            # isolate the failing window(s)
+            outs = []
+            for t in texts:
+                try:
+                    outs.append(engine.classify_toxicity([t])[0])
+                except Exception:
+                    outs.append([])
+        for j, out in zip(batch, outs):
+            parsed[j] = parse_labels(out)
+    per_sentence = [{} for _ in sentences]
+    for i, per_label in zip(owner, parsed):
+        acc = per_sentence[i]
+        for lbl, score in per_label.items():
+            acc[lbl] = max(acc.get(lbl, score), score)
+    return per_sentence
 
 TOXIC_LEXICON = [
     "fuck","die","kill","bomb","terror","i hate","immigrant","immigrants",
     "nigger","bitch","slur","go die","go to hell","fascist","kill yourself"
 ]
 
+_REPEAT = re.compile(r'(.)\1{2,}')
+_LEET = str.maketrans({'4': 'a', '3': 'e', '1': 'i', '0': 'o', '5': 's'})
+
 def normalize_text_for_lexicon(t: str):
     t = str(t).lower()
-    t = re.sub(r'(.)\1{2,}', r'\1\1', t)
-    t = t.replace('4','a').replace('3','e').replace('1','i').replace('0','o').replace('5','s')
+    t = _REPEAT.sub(r'\1\1', t)
+    t = t.translate(_LEET)
     t = unicodedata.normalize('NFKD', t)
     return t
 
+def normalize_with_offsets(t: str):
+    # normalize_text_for_lexicon(t) plus, for every output char, the index of
+    # the input char it came from. lower() and NFKD may expand a char; their
+    # only context-dependent parts (final sigma, mark reordering) keep lengths.
+    t = str(t)
+    low = t.lower()
+    src = range(len(t)) if len(low) == len(t) else [i for i, c in enumerate(t) for _ in c.lower()]
+    keep, prev = [], 0
+    for m in _REPEAT.finditer(low):
+        keep.extend(range(prev, m.start() + 2))
+        prev = m.end()
+    keep.extend(range(prev, len(low)))
+    src = [src[i] for i in keep]
+    collapsed = ''.join(low[i] for i in keep).translate(_LEET)
+    out = unicodedata.normalize('NFKD', collapsed)
+    if len(out) != len(collapsed):
+        src = [j for j, c in zip(src, collapsed) for _ in unicodedata.normalize('NFKD', c)]
+    return out, src
+
+@lru_cache(maxsize=None)
+def toxic_lexicon():
+    if TOXIC_LEXICON_PATH:
+        lex = Lexicon.from_file(TOXIC_LEXICON_PATH, normalize=normalize_text_for_lexicon)
+        print(f"Loaded {len(lex)} lexicon terms from {TOXIC_LEXICON_PATH}.")
+        return lex
+    return Lexicon(TOXIC_LEXICON, normalize=normalize_text_for_lexicon)
+
 def lexicon_hits(text: str):
-    t = normalize_text_for_lexicon(text)
-    return [w for w in TOXIC_LEXICON if w in t]
+    return toxic_lexicon().found(normalize_text_for_lexicon(text))
+
+def lexicon_matches(text: str):
+    # [{"term", "start", "end"}] with offsets into the original text
+    norm, src = normalize_with_offsets(text)
+    return [{"term": term, "start": src[a], "end": src[b - 1] + 1}
+            for a, b, term in toxic_lexicon().find_all(norm)]
 
-def detect_toxicity_spans(text: str, sentence_split_regex=r'(?<=[.!?\n])\s+'):
+def detect_toxicity_spans(text: str, sentence_split_regex=r'(?<=[.!?\n])\s+', engine=None):
     if not text or not text.strip():
         return [], {"notice":"green","message":"No toxicity/hate/threat detected with current detectors."}
+    if engine is None:
+        from .engine import get_default_engine
+        engine = get_default_engine()
     sentences = [s.strip() for s in re.split(sentence_split_regex, text) if s.strip()]
+    lex = [lexicon_hits(s) for s in sentences]
+    skip = [gate_sentence(s, lx) for s, lx in zip(sentences, lex)] if TOXICITY_GATING != "off" else None
+    per_labels = classify_sentences(sentences, engine, skip=skip)
     spans = []
-    for i, s in enumerate(sentences):
-        lx = lexicon_hits(s)
-        try:
-            out = toxicity_clf(s[:1000]) if toxicity_clf else []
-        except Exception:
-            out = []
-        per_label = {}
-        # Several HF pipeline shapes - handle robustly
-        if out and isinstance(out, list) and isinstance(out[0], dict) and 'label' in out[0]:
-            # list of dicts form
-            for d in out:
-                per_label[d['label'].lower()] = float(d.get('score', 0.0))
-        elif out and isinstance(out[0], list):
-            # nested list form
-            for d in out[0]:
-                per_label[d['label'].lower()] = float(d.get('score', 0.0))
-        else:
-            # fallback: attempt to parse
-            try:
-                for d in out:
-                    if isinstance(d, dict) and 'label' in d:
-                        per_label[d['label'].lower()] = float(d.get('score', 0.0))
-            except Exception:
-                per_label = {}
-
-        toxic_labels = ['toxic','severe_toxicity','threat','insult','identity_hate','obscene']
-        ml_score = max([per_label.get(lbl, 0.0) for lbl in toxic_labels]) if per_label else 0.0
+    for i, (s, lx, per_label) in enumerate(zip(sentences, lex, per_labels)):
+        ml_score = max([per_label.get(lbl, 0.0) for lbl in TOXIC_LABELS]) if per_label else 0.0
 
         categories = []
-        if per_label.get('threat', 0.0) > 0.35 or re.search(r'\b(kill|bomb|die|harm|destroy)\b', s, re.I):
+        if per_label.get('threat', 0.0) > 0.35 or THREAT_PATTERN.search(s):
             categories.append('Threat')
         if per_label.get('identity_hate', 0.0) > 0.25 or any(w in ' '.join(lx) for w in ['immigrant','nigger','fascist']):
             categories.append('Hate')
@@ -76,10 +215,14 @@ def detect_toxicity_spans(text: str, sentence_split_regex=r'(?<=[.!?\n])\s+'):
             'categories': list(set(categories))
         })
 
+    return spans, summarize_spans(spans)
+
+def summarize_spans(spans):
+    # document summary from the spans of one text or of several pages
     all_cats = set(c for sp in spans for c in sp['categories'])
     doc_toxic_score = max([sp['ml_score'] for sp in spans]) if spans else 0.0
     if not all_cats:
         summary = {"notice":"green","message":"No toxicity/hate/threat detected with current detectors.","doc_toxic_score": doc_toxic_score}
     else:
         summary = {"notice":"red","message": f"Detected categories: {', '.join(sorted(all_cats))}", "categories": sorted(all_cats), "doc_toxic_score": doc_toxic_score}
-    return spans, summary
+    return summary
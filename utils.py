@@ -1,21 +1,11 @@
-import re
 from pathlib import Path
 import pandas as pd
+from .pii import scan_pii
 
 def detect_pii(text: str):
-    found = []
     if not text:
         return []
-    if re.search(r"[\w\.-]+@[\w\.-]+\.\w+", text):
-        found.append("email")
-    if re.search(r"\b(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?){2,}\d{2,4}\b", text):
-        found.append("phone")
-    if re.search(r"\b(?:ssn|nid|nic|passport)[\s:]*[A-Za-z0-9\-]{3,}\b", text, re.I):
-        found.append("id_number")
-    m = re.search(r"\bmy name is ([A-Z][a-z]+)\b", text)
-    if m:
-        found.append("name")
-    return list(set(found))
+    return list(set(sp["type"] for sp in scan_pii(text)))
 
 def safe_read_csv(path):
     p = Path(path)
@@ -0,0 +1,283 @@
+import abc
+import argparse
+import hashlib
+import time
+from pathlib import Path
+import numpy as np
+from .config import (INDEX_TYPE, INDEX_DIR, IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION,
+                     HNSW_EF_SEARCH, PQ_M, PQ_NBITS, SCORE_BLOCK_ROWS, VECTOR_BACKEND, NUMPY_QUERY_ROWS)
+from .compact import CompactMatrix
+
+# FAISS index types for the synthetic-query vectors. All use inner product on
+# normalized vectors (= cosine). "flat" is exact; the others trade recall for
+# latency/memory and are tuned at search time with nprobe / efSearch. With
+# float16/int8 embeddings, flat / ivf_flat / hnsw store codes with the
+# matching scalar quantizer instead of float32.
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+TRAIN_SAMPLE = 65536
+
+def _as_compact(emb):
+    return emb if isinstance(emb, CompactMatrix) else CompactMatrix(np.asarray(emb, dtype=np.float32))
+
+def _sq_type(faiss, storage):
+    return {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}.get(storage)
+
+# Backends behind one interface: search(queries, k) -> (scores, rows), both
+# (n_queries, k), best first, rows padded with -1 when k exceeds the corpus.
+class VectorIndex(abc.ABC):
+    backend = None
+
+    @abc.abstractmethod
+    def search(self, queries, k):
+        ...
+
+    @property
+    def nbytes(self):
+        return 0
+
+class NumpyIndex(VectorIndex):
+    # Exact inner-product search over a CompactMatrix. Scores block_rows rows
+    # at a time for at most query_rows queries, keeping a running top-k with
+    # argpartition, so memory stays at query_rows * (k + block_rows) scores
+    # however large the corpus. Holds no mutable state: safe to share between
+    # threads.
+    backend = "numpy"
+
+    def __init__(self, emb, block_rows=SCORE_BLOCK_ROWS, query_rows=NUMPY_QUERY_ROWS):
+        self.emb = _as_compact(emb)
+        self.block_rows = block_rows
+        self.query_rows = query_rows
+
+    def __len__(self):
+        return len(self.emb)
+
+    def _search_block(self, q, k):
+        best_s = np.empty((len(q), 0), dtype=np.float32)
+        best_i = np.empty((len(q), 0), dtype=np.int64)
+        for lo, block in self.emb.blocks(self.block_rows):
+            s = np.concatenate([best_s, q @ block.T], axis=1)
+            ids = np.arange(lo, lo + len(block), dtype=np.int64)
+            ids = np.concatenate([best_i, np.broadcast_to(ids, (len(q), len(ids)))], axis=1)
+            if s.shape[1] > k:
+                part = np.argpartition(-s, k - 1, axis=1)[:, :k]
+                s, ids = np.take_along_axis(s, part, axis=1), np.take_along_axis(ids, part, axis=1)
+            best_s, best_i = s, ids
+        # best first, ties by row id
+        order = np.lexsort((best_i, -best_s), axis=1)
+        return np.take_along_axis(best_s, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+    def search(self, queries, k):
+        q = np.asarray(queries, dtype=np.float32)
+        q = q.reshape(-1, q.shape[-1])
+        D = np.full((len(q), k), -np.inf, dtype=np.float32)
+        I = np.full((len(q), k), -1, dtype=np.int64)
+        kk = min(k, len(self.emb))
+        if kk == 0:
+            return D, I
+        for lo in range(0, len(q), self.query_rows):
+            D[lo:lo + self.query_rows, :kk], I[lo:lo + self.query_rows, :kk] = self._search_block(q[lo:lo + self.query_rows], kk)
+        return D, I
+
+class FaissIndex(VectorIndex):
+    backend = "faiss"
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def search(self, queries, k):
+        D, I = self.index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        return D, I.astype(np.int64, copy=False)
+
+    @property
+    def nbytes(self):
+        import faiss
+        return int(faiss.serialize_index(self.index).nbytes)
+
+def resolve_backend(storage, index_type=INDEX_TYPE, backend=VECTOR_BACKEND):
+    if backend not in ("auto", "faiss", "numpy"):
+        raise ValueError(f"Unknown vector backend {backend!r}")
+    # A flat FAISS index over float16/int8 rows is a scalar-quantizer copy of
+    # the same codes in each process; exact NumPy search over the memory-mapped
+    # matrix gives the same ranking from shared pages.
+    if backend == "auto" and index_type == "flat" and storage != "float32":
+        return "numpy"
+    return backend
+
+def open_vector_index(emb, index_type=INDEX_TYPE, backend=VECTOR_BACKEND):
+    emb = _as_compact(emb)
+    backend = resolve_backend(emb.storage, index_type, backend)
+    if backend != "numpy":
+        try:
+            return FaissIndex(load_or_build_faiss_index(emb, index_type))
+        except Exception as e:
+            if backend == "faiss":
+                raise
+            print(f"FAISS not available or failed ({e}) — using exact NumPy search.")
+    return NumpyIndex(emb)
+
+def index_params(index_type=INDEX_TYPE):
+    if index_type == "flat":
+        return {}
+    if index_type == "ivf_flat":
+        return {"nlist": IVF_NLIST}
+    if index_type == "hnsw":
+        return {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+    if index_type == "ivf_pq":
+        return {"nlist": IVF_NLIST, "pq_m": PQ_M, "pq_nbits": PQ_NBITS}
+    raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+
+def _nlist_for(n, nlist):
+    # FAISS wants ~39 training points per centroid
+    return max(1, min(nlist, n // 39))
+
+def build_faiss_index(emb, index_type=INDEX_TYPE):
+    import faiss
+    m = _as_compact(emb)
+    n, dim = m.shape
+    params = index_params(index_type)
+    sq = _sq_type(faiss, m.storage)
+    ip = faiss.METRIC_INNER_PRODUCT
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim) if sq is None else faiss.IndexScalarQuantizer(dim, sq, ip)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["m"], ip) if sq is None else faiss.IndexHNSWSQ(dim, sq, params["m"], ip)
+        index.hnsw.efConstruction = params["ef_construction"]
+    else:
+        quantizer = faiss.IndexFlatIP(dim)
+        nlist = _nlist_for(n, params["nlist"])
+        if index_type == "ivf_flat":
+            if sq is None:
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist, ip)
+            else:
+                index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, sq, ip)
+        else:
+            if dim % params["pq_m"]:
+                raise ValueError(f"PQ_M={params['pq_m']} must divide the embedding dim {dim}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, params["pq_m"], params["pq_nbits"], ip)
+    if m.storage == "float32":
+        # already float32 (usually memory-mapped): no copy needed
+        emb = np.ascontiguousarray(m.data, dtype=np.float32)
+        if not index.is_trained:
+            index.train(emb)
+        index.add(emb)
+    else:
+        # train on a sample and add block by block so no full float32 copy exists
+        if not index.is_trained:
+            rows = np.arange(n)
+            if n > TRAIN_SAMPLE:
+                rows = np.sort(np.random.default_rng(0).choice(n, TRAIN_SAMPLE, replace=False))
+            index.train(np.ascontiguousarray(m[rows]))
+        for _, block in m.blocks(SCORE_BLOCK_ROWS):
+            index.add(np.ascontiguousarray(block))
+    set_search_params(index)
+    return index
+
+def set_search_params(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    import faiss
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except Exception:
+        ivf = None
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    return index
+
+def index_path(emb, index_type=INDEX_TYPE):
+    m = _as_compact(emb)
+    h = hashlib.blake2b(digest_size=8)
+    h.update(np.ascontiguousarray(m.data).tobytes())
+    if m.scales is not None:
+        h.update(np.ascontiguousarray(m.scales).tobytes())
+    h.update(repr(sorted(index_params(index_type).items())).encode("ascii"))
+    storage = "" if m.storage == "float32" else "." + m.storage
+    return INDEX_DIR / f"syn.{index_type}{storage}.{h.hexdigest()}.faiss"
+
+def save_index(index, path):
+    import faiss
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    faiss.write_index(index, str(tmp))
+    tmp.replace(path)
+
+def load_index(path, mmap=True):
+    # mmap maps the stored vectors / codes instead of reading them onto the
+    # heap, so every process that opens the file shares the same pages
+    import faiss
+    flags = 0
+    if mmap and hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+    return set_search_params(faiss.read_index(str(path), flags))
+
+def load_or_build_faiss_index(emb, index_type=INDEX_TYPE):
+    # Persisted under INDEX_DIR, keyed by the vectors and build params. The
+    # flat index needs no training, so it is cheaper to rebuild than to key.
+    if index_type == "flat":
+        index = build_faiss_index(emb, index_type)
+        print("Built FAISS index for synthetic queries.")
+        return index
+    path = index_path(emb, index_type)
+    if path.exists():
+        try:
+            index = load_index(path)
+            print(f"Loaded {index_type} FAISS index from {path}.")
+            return index
+        except Exception as e:
+            print(f"[WARN] Could not read {path}: {e}. Rebuilding...")
+    t0 = time.perf_counter()
+    index = build_faiss_index(emb, index_type)
+    print(f"Built {index_type} FAISS index for synthetic queries in {time.perf_counter() - t0:.1f}s.")
+    save_index(index, path)
+    return index
+
+def recall_report(emb, queries, k=10, index_types=INDEX_TYPES):
+    # Recall@k of each index type against the exact float32 flat index, plus
+    # search latency per query and serialized size.
+    import faiss
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    exact = build_faiss_index(_as_compact(emb).to_float32(), "flat")
+    _, truth = exact.search(queries, k)
+    report = []
+    for index_type in index_types:
+        t0 = time.perf_counter()
+        index = build_faiss_index(emb, index_type)
+        build_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        _, found = index.search(queries, k)
+        search_s = time.perf_counter() - t0
+        hits = sum(len(set(f[f >= 0].tolist()) & set(t.tolist())) for f, t in zip(found, truth))
+        report.append({
+            "index_type": index_type,
+            "params": index_params(index_type),
+            "recall_at_k": round(hits / float(truth.size), 4),
+            "ms_per_query": round(1000.0 * search_s / len(queries), 4),
+            "size_mb": round(faiss.serialize_index(index).nbytes / 1e6, 2),
+            "build_s": round(build_s, 2),
+        })
+    return report
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare FAISS index types against the exact flat index.")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=1000, help="number of synthetic queries used as probes")
+    ap.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    args = ap.parse_args(argv)
+
+    from .engine import get_default_engine
+    emb = get_default_engine().syn_emb
+    rng = np.random.default_rng(0)
+    probes = emb[np.sort(rng.choice(len(emb), size=min(args.queries, len(emb)), replace=False))]
+    # perturb the probes so they are not exact copies of indexed rows
+    probes = probes + rng.normal(scale=0.02, size=probes.shape).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    print(f"{'index':<10} {'recall@' + str(args.k):>10} {'ms/query':>10} {'size MB':>9} {'build s':>8}  params")
+    for r in recall_report(emb, probes, k=args.k, index_types=args.types):
+        print(f"{r['index_type']:<10} {r['recall_at_k']:>10} {r['ms_per_query']:>10} {r['size_mb']:>9} {r['build_s']:>8}  {r['params']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import hashlib
+import json
+import time
+import zlib
+from pathlib import Path
+from . import config
+from .config import VERDICT_CACHE_PATH, VERDICT_CACHE_MAX_BYTES, INDEX_BUNDLE_PATH
+from .caches import SqliteCache
+from .corpus_bundle import read_bundle, source_fingerprint
+
+# Whole-document classify_pdf results, keyed by
+#   <fingerprint>|<sha256 of the file>|<call arguments>
+# where the fingerprint covers everything else the result depends on: the
+# output-affecting settings below, the corpus (source CSV hashes and bundle
+# version), the toxicity lexicon, the cascade calibration and the package code. A changed fingerprint
+# never matches old entries; `prune` removes them.
+
+FINGERPRINT_SETTINGS = (
+    "RETRIEVER_MODEL", "RERANKER_MODEL", "TOXICITY_MODEL", "RETRIEVER_REVISION", "RERANKER_REVISION",
+    "MODEL_BACKEND", "ONNX_QUANTIZE", "ONNX_QUANT_CONFIG", "EMBED_STORAGE",
+    "INDEX_TYPE", "VECTOR_BACKEND", "IVF_NLIST", "IVF_NPROBE", "HNSW_M", "HNSW_EF_CONSTRUCTION", "HNSW_EF_SEARCH",
+    "PQ_M", "PQ_NBITS", "TOP_K", "RERANK_TOP", "RETRIEVAL_MODE", "POLICY_TOP_N", "SPARSE_MODE", "SPARSE_TOP_N",
+    "RRF_K", "RERANK_ALPHA", "RERANK_MODE", "CASCADE_BOUND_QUANTILE", "CASCADE_BINS", "CASCADE_MIN_BIN_PAIRS",
+    "SIM_THRESHOLD", "RISK_LEVEL_THRESHOLDS", "DOC_SIGNALS", "DOC_RETRIEVAL_PASS", "PII_STREAM_OVERLAP",
+    "TOXICITY_MAX_TOKENS", "TOXICITY_WINDOW_OVERLAP", "TOXIC_LEXICON_PATH", "TOXICITY_GATING",
+    "TOXICITY_GATE_MIN_CHARS", "OCR_ZOOM_LADDER", "OCR_DENOISE_SIGMA", "OCR_NOISE_MIN_PX", "OCR_LANG",
+    "OCR_CONF_THRESHOLD",
+)
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _file_digest(path):
+    p = Path(path)
+    return hashlib.sha256(p.read_bytes()).hexdigest() if p.is_file() else None
+
+def _code_digest():
+    h = hashlib.sha256()
+    for p in sorted(Path(__file__).parent.glob("*.py")):
+        h.update(p.name.encode("utf-8"))
+        h.update(p.read_bytes())
+    return h.hexdigest()
+
+def _bundle_header():
+    if not Path(INDEX_BUNDLE_PATH).exists():
+        return None
+    try:
+        return read_bundle(INDEX_BUNDLE_PATH)[0]
+    except Exception:
+        return None
+
+def fingerprint_parts():
+    settings = {name: getattr(config, name) for name in FINGERPRINT_SETTINGS}
+    lexicon = config.TOXIC_LEXICON_PATH
+    calibration = config.CASCADE_CALIBRATION_PATH if config.RERANK_MODE == "cascade" else None
+    header = _bundle_header()
+    return {"settings": settings, "sources": source_fingerprint(header),
+            "bundle_version": header.get("bundle_version") if header else None,
+            "lexicon": _file_digest(lexicon) if lexicon else None,
+            "cascade_calibration": _file_digest(calibration) if calibration else None, "code": _code_digest()}
+
+def config_fingerprint():
+    blob = json.dumps(fingerprint_parts(), sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+def verdict_key(file_digest, fingerprint, **args):
+    return f"{fingerprint}|{file_digest}|{json.dumps(args, sort_keys=True)}"
+
+def open_verdict_cache(path=VERDICT_CACHE_PATH):
+    return SqliteCache(path, max_bytes=VERDICT_CACHE_MAX_BYTES)
+
+def encode_verdict(out):
+    return zlib.compress(json.dumps(out, ensure_ascii=False).encode("utf-8"))
+
+def decode_verdict(blob):
+    return json.loads(zlib.decompress(blob))
+
+def _fmt_time(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Inspect and prune the classify_pdf verdict cache.")
+    ap.add_argument("--path", default=str(VERDICT_CACHE_PATH) if VERDICT_CACHE_PATH else None,
+                    help="cache file (default: VERDICT_CACHE_PATH)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="entries, size and how many match the current fingerprint")
+    ls = sub.add_parser("list", help="entries, most recently used first")
+    ls.add_argument("--limit", type=int, default=20)
+    pr = sub.add_parser("prune", help="drop entries for other fingerprints and / or unused ones")
+    pr.add_argument("--keep-stale", action="store_true", help="keep entries whose fingerprint is not the current one")
+    pr.add_argument("--older-than", type=float, default=None, metavar="DAYS", help="also drop entries unused for DAYS")
+    sub.add_parser("clear", help="drop every entry")
+    args = ap.parse_args(argv)
+    if not args.path:
+        ap.error("no cache: set VERDICT_CACHE_PATH or pass --path")
+
+    cache = open_verdict_cache(args.path)
+    current = config_fingerprint()
+    if args.cmd == "stats":
+        entries = cache.entries()
+        fresh = [e for e in entries if e[0].startswith(current + "|")]
+        print(f"{args.path}: {len(entries)} entries, {sum(e[1] for e in entries) / 1e6:.1f} MB "
+              f"(cap {VERDICT_CACHE_MAX_BYTES / 1e6:.0f} MB)")
+        print(f"current fingerprint {current}: {len(fresh)} entries, {len(entries) - len(fresh)} stale")
+    elif args.cmd == "list":
+        print(f"{'last used':<19} {'KB':>7}  {'fingerprint':<16} {'sha256':<12} {'risk':<6} source")
+        for key, size, atime, value in cache.entries(values=True)[:args.limit]:
+            fp, digest, _ = key.split("|", 2)
+            out = decode_verdict(value)
+            mark = "" if fp == current else " (stale)"
+            print(f"{_fmt_time(atime):<19} {size / 1e3:>7.1f}  {fp:<16} {digest[:12]:<12} "
+                  f"{out.get('risk_level', '?'):<6} {out.get('source', '?')}{mark}")
+    elif args.cmd == "prune":
+        cutoff = time.time() - args.older_than * 86400 if args.older_than is not None else None
+        drop = [key for key, size, atime in cache.entries()
+                if (not args.keep_stale and not key.startswith(current + "|")) or (cutoff is not None and atime < cutoff)]
+        cache.delete(drop)
+        print(f"Removed {len(drop)} entries.")
+    elif args.cmd == "clear":
+        cache.clear()
+        print("Cleared.")
+
+if __name__ == "__main__":
+    main()